@@ -0,0 +1,212 @@
+from typing import Dict, List, Optional
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import multiprocessing
+from statistics import median
+
+from scheduler import Scheduler, SCHEDULERS, make_scheduler
+from tracing import tracer, LEVELS
+from workload import generate, add_workload_arguments
+
+
+# README!!!
+# To benchmark the executors on a synthetic workload, do
+# python benchmark.py [workload options of workload.py] [--modes 2pl,occ,mvcc,threaded,cooperative] [--repeat <n>]
+#                     [--baseline <file>] [--save-baseline <file>] [--tolerance <fraction>]
+
+MODES = ["2pl", "occ", "mvcc", "threaded", "cooperative"]
+# metric: True if bigger is better; only these are compared against a baseline
+COMPARED = {"throughput": True, "p50_ms": False, "p99_ms": False, "peak_kib": False}
+
+
+class TimingScheduler(Scheduler):
+    # wraps the scheduler of a run and times every transaction from the first time it is picked until it finishes
+    def __init__(self, inner: Scheduler):
+        self.inner = inner
+        self.started: Dict[int, float] = {}
+        self.latencies: List[float] = []
+
+    def add(self, tid: int) -> None:
+        self.inner.add(tid)
+
+    def block(self, tid: int) -> None:
+        self.inner.block(tid)
+
+    def wake(self, tid: int) -> None:
+        self.inner.wake(tid)
+
+    def finish(self, tid: int) -> None:
+        self.inner.finish(tid)
+        started = self.started.pop(tid, None)
+        if started is not None:
+            self.latencies.append(time.perf_counter() - started)
+
+    def next(self) -> Optional[int]:
+        tid = self.inner.next()
+        if tid is not None and tid not in self.started:
+            self.started[tid] = time.perf_counter()
+        return tid
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(p * len(ordered)), len(ordered) - 1)]
+
+
+# run one mode over the files and measure it; runs in a fresh process so peak memory belongs to this run alone
+def measure(mode: str, item_count: int, files: List[str], scheduler_name: str, seed: Optional[int]) -> Dict:
+    import resource
+    from main import setup, run
+
+    tracer.configure(LEVELS["off"])
+    DB, transactions, Manager = setup(item_count, files)
+    scheduler = TimingScheduler(make_scheduler(scheduler_name, seed, lambda tid: transactions[tid].remaining()))
+    deadlocks = aborts = 0
+    # occ and mvcc restart their aborted transactions, 2pl victims stay aborted
+    commits = len(files)
+    start = time.perf_counter()
+    if mode == "2pl":
+        victim = Manager.abort
+
+        def abort(tid: int) -> None:
+            nonlocal deadlocks
+            deadlocks += 1
+            victim(tid)
+
+        Manager.abort = abort
+        run(DB, Manager, transactions, scheduler)
+        aborts = deadlocks
+        commits -= aborts
+        latencies = scheduler.latencies
+    elif mode == "occ":
+        from occ import run_occ
+        aborts = run_occ(DB, transactions, scheduler, item_count).aborts
+        latencies = scheduler.latencies
+    elif mode == "mvcc":
+        from mvcc import run_mvcc
+        aborts = run_mvcc(DB, transactions, scheduler)[1]
+        latencies = scheduler.latencies
+    elif mode == "threaded":
+        from threaded import ThreadSafeLockManager, run_threaded
+        Manager = ThreadSafeLockManager(DB)
+        result = run_threaded(DB, Manager, transactions, 4)
+        deadlocks = aborts = len(result.aborted)
+        commits = len(result.commit_order)
+        latencies = result.latencies
+    elif mode == "cooperative":
+        import asyncio
+        from cooperative import CooperativeLockManager, run_cooperative
+        Manager = CooperativeLockManager(DB)
+        result = asyncio.run(run_cooperative(DB, Manager, transactions, 64))
+        deadlocks = aborts = len(result.aborted)
+        commits = len(result.commit_order)
+        latencies = result.latencies
+    else:
+        raise ValueError("unknown mode " + repr(mode))
+    elapsed = time.perf_counter() - start
+    DB.close()
+    return {
+        "mode": mode,
+        "commits": commits,
+        "aborts": aborts,
+        "deadlocks": deadlocks,
+        "elapsed": elapsed,
+        "throughput": commits / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        # ru_maxrss is in KiB on Linux
+        "peak_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+# run every mode repeat times, each run in its own process, and keep the median of every metric
+def run_benchmark(modes: List[str], item_count: int, files: List[str], scheduler_name: str, seed: Optional[int],
+                  repeat: int) -> Dict[str, Dict]:
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        for mode in modes:
+            runs = [pool.apply(measure, (mode, item_count, files, scheduler_name, seed)) for _ in range(repeat)]
+            results[mode] = {metric: (median(run[metric] for run in runs)
+                                      if isinstance(runs[0][metric], (int, float)) else runs[0][metric])
+                             for metric in runs[0]}
+    return results
+
+
+def format_result(result: Dict) -> str:
+    return ("%-11s %10.1f txn/s  p50 %8.3f ms  p99 %8.3f ms  aborts %6d  deadlocks %6d  peak %8d KiB" %
+            (result["mode"], result["throughput"], result["p50_ms"], result["p99_ms"], result["aborts"],
+             result["deadlocks"], result["peak_kib"]))
+
+
+# compare results against a stored baseline, return the lines describing a regression beyond tolerance
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float) -> List[str]:
+    regressions = []
+    for mode, result in results.items():
+        old = baseline.get(mode)
+        if old is None:
+            continue
+        for metric, bigger_is_better in COMPARED.items():
+            before, after = old.get(metric), result.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            print("  %-11s %-10s %12.3f -> %12.3f  %+6.1f%%" % (mode, metric, before, after, change * 100))
+            if (-change if bigger_is_better else change) > tolerance:
+                regressions.append(mode + " " + metric + " regressed by " + format(abs(change) * 100, ".1f") + "%")
+    return regressions
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the executors on a synthetic workload.")
+    add_workload_arguments(parser)
+    parser.add_argument("--modes", default=",".join(MODES), help="comma-separated modes out of " + ", ".join(MODES))
+    parser.add_argument("--scheduler", choices=SCHEDULERS, default="random", help="scheduler of the simulated modes")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per mode, the median is reported")
+    parser.add_argument("--workload-dir", default=None, help="keep the generated files here instead of a temp dir")
+    parser.add_argument("--baseline", default=None, help="JSON results of an earlier run to compare against")
+    parser.add_argument("--save-baseline", default=None, help="write the results to this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="relative change of a compared metric that counts as a regression")
+    args = parser.parse_args(argv)
+    args.modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    for mode in args.modes:
+        if mode not in MODES:
+            parser.error("unknown mode " + repr(mode))
+    if args.baseline and not os.path.isfile(args.baseline):
+        parser.error("baseline " + repr(args.baseline) + " does not exist")
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+    with tempfile.TemporaryDirectory() as scratch:
+        directory = args.workload_dir or scratch
+        files = generate(directory, args.items, args.transactions, args.length, args.read_ratio, args.skew,
+                         args.mix, args.locals, args.seed)
+        results = run_benchmark(args.modes, args.items, files, args.scheduler, args.seed, args.repeat)
+    for mode in args.modes:
+        print(format_result(results[mode]))
+    workload = {key: getattr(args, key) for key in ("items", "transactions", "length", "read_ratio", "skew", "mix",
+                                                    "locals", "seed", "scheduler")}
+    failed = False
+    if args.baseline:
+        with open(args.baseline) as file:
+            stored = json.load(file)
+        if stored.get("workload") != workload:
+            print("baseline was measured on a different workload: " + json.dumps(stored.get("workload")))
+        print("compared to " + args.baseline + ":")
+        regressions = compare(results, stored["results"], args.tolerance)
+        for line in regressions:
+            print("REGRESSION: " + line)
+        failed = bool(regressions)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as file:
+            json.dump({"workload": workload, "results": results}, file, indent=2)
+    sys.exit(1 if failed else 0)
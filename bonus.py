@@ -1,311 +1,119 @@
-from typing import List, Tuple, Dict, Deque
+from typing import Dict, List
 import sys
 import random
-from collections import deque
+import argparse
+import itertools
+
+import main
+from main import Database, LockManager, Transaction, ValueOutOfRange, setup, processing, commit, rollback
+from tracing import tracer, LEVELS, SUMMARY
 
 
 # README!!!
 # To run this program, do
-# python bonus.py <number of elements in the database> <file 1> <file 2> ...
-
-
-class Database:
-    def __init__(self, k: int, nonzero: bool):
-        # database to store k integers
-        self.database = [i + 1 for i in range(k)] if nonzero else [0] * k
-
-    def read(self, k: int) -> int:
-        return self.database[k]
-
-    def write(self, k: int, w: int) -> None:
-        self.database[k] = w
-
-    def print(self) -> None:
-        print("Database:", self.database)
-
-
-class LockManager:
-    def __init__(self, DB: Database):
-        # We need to create a lock table based on the data items in the DB
-        # {data item: list of transaction ids holding the lock on this data item}
-        self.lock_table: Dict[int, List[int]] = {i: [] for i in range(len(DB.database))}
-        # Also create a table to see which transaction has which locks to make it more efficient
-        # it's a dictionary where each tid has a list of tuples: int contains the index to be locked,
-        # bool is whether it's an S-Lock: True for S-lock, False for X-lock
-        self.transaction_locks: Dict[int, List[Tuple[int, bool]]] = {}
-
-    # transaction id, kth integer of the database, if the request is for a S-lock
-    # return 1 if lock is granted, 0 if not
-    def request(self, tid: int, k: int, is_s_lock: bool) -> int:
-        granted = False
-        # if we can grant this lock, we need to first release all lock held previously by this tid
-        if is_s_lock:
-            # if no other transaction has an X-lock
-            if not self.has_x_lock_on(k, tid):
-                granted = True
-                self.lock_table[k].append(tid)
-                self.transaction_locks.setdefault(tid, []).append((k, True))
-        else:
-            # if it's an x-lock, we need to first check if any other transactions has any lock on k
-            if not self.has_lock_on(k, tid):
-                granted = True
-                # see if the current tid holds a lock on k already
-                if tid in self.lock_table[k]:
-                    for i, (curr_k, curr_is_s_lock) in enumerate(self.transaction_locks[tid]):
-                        if curr_k == k:
-                            # update to an X-lock
-                            self.transaction_locks[tid][i] = (k, False)
-                # if the current tid does not hold a lock on k
-                else:
-                    self.lock_table[k].append(tid)
-                    self.transaction_locks.setdefault(tid, []).append((k, False))
-        statement = "T" + str(tid) + " request " + ("S" if is_s_lock else "X") + "-lock on item " + str(
-            k) + ": " + ("G" if granted else "D")
-        print(statement)
-        return 1 if granted else 0
-
-    # release all locks held by transaction tid
-    # return the number of locks released
-    def releaseAll(self, tid: int) -> int:
+# python bonus.py <number of elements in the database> <file 1> <file 2> ... [--scheme wait-die|wound-wait]
 
-        if tid not in self.transaction_locks:
-            return 0
-        locks_released = len(self.transaction_locks[tid])
-        del self.transaction_locks[tid]
-        for item, locks in self.lock_table.items():
-            if tid in locks:
-                locks.remove(tid)
-                self.lock_table[item] = locks
-        return locks_released
 
-    # return all locks held by tid
-    def showLocks(self, tid: int) -> List[Tuple[int, bool]]:
-        locks_held = self.transaction_locks[tid] if tid in self.transaction_locks else []
-        return locks_held
-
-    # shows if a data item has any lock on it
-    def has_lock_on(self, item: int, tid: int) -> bool:
-        for id in self.lock_table[item]:
-            # if there exists any other tids that hold this item and are not the tid, return True
-            if id != tid:
-                return True
-        return False
-
-    # shows if a data item has any x-lock on it
-    def has_x_lock_on(self, item: int, tid: int) -> bool:
-        transactions = self.lock_table[item]
-        for id, transaction in enumerate(transactions):
-            # we're only checking other transactions so we need to ignore the current one
-            if tid != id:
-                locks = self.transaction_locks[transaction]
-                for data, is_s_lock in locks:
-                    if not is_s_lock:
-                        return True
+# performs the next command, and settles the conflict by timestamps if its lock request is denied
+# returns true if this command is allowed to proceed
+def do_next_command(db: Database, manager: LockManager, transaction: Transaction, tid: int,
+                    timestamps: "Timestamps", scheme: str, transactions: List[Transaction]) -> bool:
+    # a transaction gets its timestamp the first time it is scheduled
+    timestamps.start(tid)
+    try:
+        granted = main.do_next_command(db, manager, transaction, tid)
+    except ValueOutOfRange as error:
+        tracer.event(SUMMARY, str(error))
+        abort(db, transactions, tid, manager)
         return False
+    if not granted and not transaction.finished():
+        resolve_conflict(db, scheme, timestamps, transactions, tid, manager)
+    return granted
 
 
-class Transaction:
-    def __init__(self, k: int):
-        self.local = [i for i in range(k)]
-        self.commands = []
-
-    # read the source-th number from the db and set it local[dest]
-    def read(self, db: Database, source: int, dest: int) -> None:
-        # read db[x] and store it to local[y]
-        print("read db[", source, "] and store it to local[", dest, "]", sep='')
-        self.local[dest] = db.read(source)
-
-    # write local[source] to the dest-th number in the db
-    def write(self, db: Database, source: int, dest: int) -> None:
-        # write local[x] to db[y]
-        print("write local[", source, "] to db[", dest, "]", sep='')
-        db.write(dest, self.local[source])
-
-    def add(self, source: int, v: int) -> None:
-        # local[x] = local[x] + d
-        print("local[", source, "] = local[", source, "] + ", v, sep='')
-        self.local[source] += v
-
-    def sub(self, source: int, v: int) -> None:
-        print("local[", source, "] = local[", source, "] - ", v, sep='')
-        self.local[source] -= v
-
-    def mult(self, source: int, v: int) -> None:
-        print("local[", source, "] = local[", source, "] * ", v, sep='')
-        self.local[source] *= v
-
-    def copy(self, s1: int, s2: int) -> None:
-        # local[x] = local[y]
-        print("local[", s1, "] = local[", s2, "] + ", sep='')
-        self.local[s1] = self.local[s2]
-
-    def combine(self, s1: int, s2: int) -> None:
-        # local[x] = local[x] + local[y]
-        print("local[", s1, "] = local[", s1, "] + local[", s2, "]", sep='')
-        self.local[s1] += self.local[s2]
-
-    def display(self) -> None:
-        for num in self.local:
-            print(num, end=' ')
-        print()
-
-    def add_command(self, operator, operand1, operand2):
-        self.commands.append([operator, operand1, operand2])
-
-    # a transaction is finished if the length of its commands is 0
-    def finished(self) -> bool:
-        return len(self.commands) == 0
-
-
-# set up the program, including creating a database, reading transaction files, and creating transactions
-def setup(item_count: int, transaction_files: List[str]):
-    # create database
-    DB = Database(item_count, True)
-    Manager = LockManager(DB)
-    transactions = []
-    # read transactions and add them to an array of transactions
-    for file_name in transaction_files:
-        transaction = read_transaction_file(file_name)
-        transactions.append(transaction)
-    return DB, transactions, Manager
-
+class Timestamps:
+    # every transaction gets a monotonic timestamp when it starts; a smaller timestamp means older
+    def __init__(self):
+        self.timestamps: Dict[int, int] = {}
+        self.clock = itertools.count()
 
-def read_transaction_file(file_name: str) -> Transaction:
-    with open(file_name) as file:
-        for i, line in enumerate(file):
-            if i == 0:
-                local_variable_count = line.strip().split(" ")[1]
-                local_variable_count = int(local_variable_count)
-                transaction = Transaction(local_variable_count)
-            else:
-                operator, operand1, operand2 = line.strip().split(" ")
-                transaction.add_command(operator, int(operand1), int(operand2))
-    return transaction
+    def start(self, tid: int) -> None:
+        if tid not in self.timestamps:
+            self.timestamps[tid] = next(self.clock)
 
+    def __getitem__(self, tid: int) -> int:
+        return self.timestamps[tid]
 
-# determines if the program can still process more transactions and can therefore proceed
-def processing(transactions: List[Transaction]) -> bool:
-    for transaction in transactions:
-        if not transaction.finished():
-            return True
-    return False
+    # when a transaction Ti request a lock on an object, but Tj currently have the lock
+    # if Ti started before Tj, Ti is older
+    def older(self, Ti: int, Tj: int) -> bool:
+        return self.timestamps[Ti] < self.timestamps[Tj]
 
 
-def print_transactions(transactions: List[Transaction]) -> None:
-    for transaction in transactions:
-        transaction.display()
+def abort(db: Database, transactions: List[Transaction], tid: int, manager: LockManager) -> None:
+    # if we need to abort, skip all the remaining commands and undo the writes made so far
+    tracer.event(SUMMARY, "Abort T" + str(tid))
+    transactions[tid].abort()
+    rollback(db, tid)
+    manager.releaseAll(tid)
 
 
-# performs the next command and removes it from the list
-# returns true if this command is allowed to proceed
-def do_next_command(db: Database, manager: LockManager, transaction: Transaction, tid: int,
-                    transaction_order: Deque[int]):
-    operator, operand1, operand2 = transaction.commands[0]
-    if operator == 'R':
-        granted = manager.request(tid, operand1, True)
-    elif operator == 'W':
-        granted = manager.request(tid, operand2, False)
+# called when tid's lock request was denied; compares timestamps with everything tid waits for
+def resolve_conflict(db: Database, scheme: str, timestamps: Timestamps, transactions: List[Transaction], tid: int,
+                     manager: LockManager) -> None:
+    if scheme == "wait-die":
+        wait_die(db, timestamps, transactions, tid, manager)
     else:
-        granted = True
+        wound_wait(db, timestamps, transactions, tid, manager)
 
-    if granted:
-        transaction.commands.pop(0)
-        # remove it from the list and append it to the end of the queue
-        if tid not in transaction_order:
-            transaction_order.append(tid)
-        else:
-            transaction_order.remove(tid)
-            transaction_order.append(tid)
 
-    # read
-    if operator == 'R':
-        if granted:
-            print("T" + str(curr_transaction_index) + " execute ", end='')
-            transaction.read(db, operand1, operand2)
-        else:
-            wait_die(transaction_order, transaction, tid, operand1, manager)
-    # write
-    elif operator == 'W':
-        if granted:
-            print("T" + str(curr_transaction_index) + " execute ", end='')
-            transaction.write(db, operand1, operand2)
-        else:
-            wait_die(transaction_order, transaction, tid, operand2, manager)
-    # add
-    elif operator == 'A':
-        print("T" + str(curr_transaction_index) + " execute ", end='')
-        transaction.add(operand1, operand2)
-    # subtract
-    elif operator == 'S':
-        print("T" + str(curr_transaction_index) + " execute ", end='')
-        transaction.sub(operand1, operand2)
-    # multiply
-    elif operator == 'M':
-        print("T" + str(curr_transaction_index) + " execute ", end='')
-        transaction.mult(operand1, operand2)
-    # copy
-    elif operator == 'C':
-        print("T" + str(curr_transaction_index) + " execute ", end='')
-        transaction.copy(operand1, operand2)
-    # combine
-    elif operator == 'O':
-        print("T" + str(curr_transaction_index) + " execute ", end='')
-        transaction.combine(operand1, operand2)
-    # print the current elements in the database
-    elif operator == 'P':
-        db.print()
-
-    return granted
+def wait_die(db: Database, timestamps: Timestamps, transactions: List[Transaction], tid: int,
+             manager: LockManager) -> None:
+    # find the oldest transaction we are waiting for, holding the lock or queued ahead of us
+    waiting_for = manager.waits_for.get(tid)
+    if not waiting_for:
+        return
+    Tj = min(waiting_for, key=timestamps.__getitem__)
+    # if we're older, wait and skip to the next transaction pass, otherwise die
+    if not timestamps.older(tid, Tj):
+        abort(db, transactions, tid, manager)
 
 
-def print_locks(transactions: List[Transaction], manager: LockManager):
-    for tid, transaction in enumerate(transactions):
-        print(manager.showLocks(tid))
+def wound_wait(db: Database, timestamps: Timestamps, transactions: List[Transaction], tid: int,
+               manager: LockManager) -> None:
+    # an older transaction wounds (aborts) every younger one in its way, a younger one waits
+    for Tj in list(manager.waits_for.get(tid, ())):
+        if tid in manager.waiting and timestamps.older(tid, Tj):
+            abort(db, transactions, Tj, manager)
 
 
-def wait_die(transaction_order: Deque[int], transaction: Transaction, tid: int, item: int, manager: LockManager):
-    # print(manager.lock_table, item)
-    # find what transaction is holding the lock we want
-    transactions_holding = manager.lock_table[item]
-    # sort the transactions based on the timestamp
-    transactions_holding = sorted(transactions_holding, key=lambda x: transaction_order.index(x))
-    # print("Transactions holding this item:", transactions_holding)
-    # get the first one that is not the current transaction
-    for id in transactions_holding:
-        if id != tid:
-            Tj = id
-            break
-
-    # if we're waiting, then skip to the next transaction pass
-    if not wait(transaction_order, tid, Tj):
-        # if we need to abort, delete all the commands
-        print("Abort T", tid, sep='')
-        # print("Transaction timestamp", transaction_order)
-        # print("T", Tj, " has Locks: ", manager.showLocks(Tj), sep='')
-        transaction.commands = []
-        manager.releaseAll(tid)
-
-
-def wait(transaction_order: Deque[int], Ti: int, Tj: int) -> bool:
-    # when a transaction Ti request a lock on an object, but Tj currently have the lock
-    # if i < j, meaning i is older, then wait
-    i, j = transaction_order.index(Ti), transaction_order.index(Tj)
-    return i < j
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run transaction files with timestamp-based deadlock prevention.")
+    parser.add_argument("item_count", type=int, help="number of elements in the database")
+    parser.add_argument("files", nargs="+", help="transaction files")
+    parser.add_argument("--scheme", choices=["wait-die", "wound-wait"], default="wait-die",
+                        help="deadlock prevention scheme")
+    parser.add_argument("--trace", choices=list(LEVELS), default="full", help="how much of the run to trace")
+    return parser.parse_args(argv)
 
 
 if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        raise "No command line argument!"
-    DB, transactions, Manager = setup(int(sys.argv[1]), sys.argv[2:])
-    transaction_order = deque([])
+    args = parse_args(sys.argv[1:])
+    tracer.configure(LEVELS[args.trace])
+    DB, transactions, Manager = setup(args.item_count, args.files)
+    timestamps = Timestamps()
+    # wait-die and wound-wait never let a cycle form, so the waits-for detector is not needed
+    Manager.detect_deadlocks = False
     while processing(transactions):
         # randomly pick a transaction
         curr_transaction_index = random.randrange(0, len(transactions))
         # process the next instruction
         curr_transaction = transactions[curr_transaction_index]
         if not curr_transaction.finished():
-            do_next_command(DB, Manager, curr_transaction, curr_transaction_index, transaction_order)
+            do_next_command(DB, Manager, curr_transaction, curr_transaction_index, timestamps, args.scheme,
+                            transactions)
         # if the current transaction is finished, release all locks
         if curr_transaction.finished():
-            Manager.releaseAll(curr_transaction_index)
+            commit(DB, Manager, curr_transaction_index)
+    tracer.flush()
     DB.print()
@@ -0,0 +1,213 @@
+from typing import List, Tuple
+import os
+import sys
+import random
+import argparse
+import tempfile
+
+from main import (Database, LockManager, Transaction, TransactionReader, ValueOutOfRange, VICTIM_POLICIES, OP_WRITE,
+                  EXECUTE, execute_command, check_value, parse_transaction, setup, run, replay)
+from conflicts import plan, run_batches
+import vectorized
+from scheduler import SCHEDULERS, make_scheduler
+from schedule import ScheduleRecorder
+from tracing import tracer, LEVELS
+from workload import generate
+
+
+# README!!!
+# To check that the shortcuts the executor takes don't change what a run computes, do
+# python checks.py [--programs <n>] [--runs <n>] [--batches <n>] [--seed <n>]
+#
+# fused:  random transactions, mostly local commands, run once through execute_command (every run of local commands
+#         fused and constant-folded, read in small chunks so runs are cut at window ends) and once one command at a
+#         time through the EXECUTE handlers; both must end with the same locals and database, or both stop at the
+#         same write of a value out of int64 range
+# replay: random workloads run under the random, round-robin and shortest schedulers and recorded; recording the
+#         same run twice must write byte-identical schedule files, and replaying the schedule must end with a
+#         byte-identical database and the same locals in every transaction
+# vectorized: random conflict-free batches, some of whose arithmetic leaves int64 range, run in lockstep on the
+#         vectorized interpreter and one transaction at a time; both must end with the same database and locals
+#         (needs NumPy, skipped without it)
+# Every failure is printed with what it takes to reproduce it; the exit status is the number of failures.
+
+LOCAL_OPERATORS = "ASMCO"
+
+
+# the text of a random transaction file of about length commands over item_count items and local_count locals
+# a fifth of the multipliers are large, so some programs write a value out of int64 range
+# with first_item, the items are first_item..first_item+item_count-1
+def random_program(rng: random.Random, item_count: int, local_count: int, length: int, first_item: int = 0) -> bytes:
+    lines = [str(length) + " " + str(local_count)]
+    for _ in range(length):
+        roll = rng.random()
+        # a negative local index counts from the end, as it does for a list
+        x = rng.randrange(-local_count, local_count)
+        if roll < 0.1:
+            lines.append("R " + str(first_item + rng.randrange(item_count)) + " " + str(x))
+        elif roll < 0.2:
+            lines.append("W " + str(x) + " " + str(first_item + rng.randrange(item_count)))
+        else:
+            operator = rng.choice(LOCAL_OPERATORS)
+            if operator == 'C' or operator == 'O':
+                lines.append(operator + " " + str(x) + " " + str(rng.randrange(-local_count, local_count)))
+            elif operator == 'M':
+                factor = rng.randint(-3, 3) if rng.random() < 0.8 else rng.choice((-1, 1)) * 10 ** rng.randint(3, 9)
+                lines.append("M " + str(x) + " " + str(factor))
+            else:
+                lines.append(operator + " " + str(x) + " " + str(rng.randint(-1000, 1000)))
+    return ("\n".join(lines) + "\n").encode()
+
+
+# run a transaction to the end; return (error, locals, database) with error the name of what stopped it, or ""
+def run_fused(transaction: Transaction, db: Database) -> Tuple[str, List[int], bytes]:
+    manager = LockManager(db)
+    try:
+        while not transaction.finished():
+            opcode, operand1, operand2 = transaction.current()
+            execute_command(db, manager, transaction, 0, opcode, operand1, operand2)
+    except ValueOutOfRange as error:
+        return type(error).__name__, transaction.local, db.snapshot().tobytes()
+    return "", transaction.local, db.snapshot().tobytes()
+
+
+def run_one_at_a_time(transaction: Transaction, db: Database) -> Tuple[str, List[int], bytes]:
+    try:
+        while not transaction.finished():
+            opcode, operand1, operand2 = transaction.current()
+            transaction.advance()
+            if opcode == OP_WRITE:
+                check_value(0, operand2, transaction.local[operand1])
+            EXECUTE[opcode](transaction, db, operand1, operand2)
+    except ValueOutOfRange as error:
+        return type(error).__name__, transaction.local, db.snapshot().tobytes()
+    return "", transaction.local, db.snapshot().tobytes()
+
+
+# return the number of programs whose fused and one-at-a-time runs differ
+def check_fused(programs: int, seed: int, directory: str) -> int:
+    rng = random.Random(seed)
+    failures = 0
+    path = os.path.join(directory, "program.txt")
+    for number in range(programs):
+        item_count, local_count = rng.randint(1, 8), rng.randint(1, 6)
+        text = random_program(rng, item_count, local_count, rng.randint(1, 60))
+        with open(path, "wb") as file:
+            file.write(text)
+        reader = TransactionReader(path, rng.choice((16, 64, 1 << 16)))
+        fused = run_fused(Transaction(reader.local_count, reader), Database(item_count, True))
+        expected = run_one_at_a_time(parse_transaction(text), Database(item_count, True))
+        if fused != expected:
+            failures += 1
+            print("fused: program " + str(number) + " (--seed " + str(seed) + ") ends with " + repr(fused[:2]) +
+                  " instead of " + repr(expected[:2]) + "\n" + text.decode())
+    return failures
+
+
+# run the workload in files under a scheduler, recording it to path; return the database bytes and every locals
+def record_run(item_count: int, files: List[str], scheduler: str, seed: int, victim: str,
+               path: str) -> Tuple[bytes, List[List[int]]]:
+    DB, transactions, Manager = setup(item_count, files, victim)
+    recorder = ScheduleRecorder(path, seed)
+    run(DB, Manager, transactions, make_scheduler(scheduler, seed, lambda tid: transactions[tid].remaining()),
+        recorder)
+    recorder.close()
+    return DB.snapshot().tobytes(), [transaction.local for transaction in transactions]
+
+
+def replay_run(item_count: int, files: List[str], path: str) -> Tuple[bytes, List[List[int]]]:
+    DB, transactions, Manager = setup(item_count, files)
+    replay(DB, Manager, transactions, path)
+    return DB.snapshot().tobytes(), [transaction.local for transaction in transactions]
+
+
+# return the number of runs whose second recording or whose replay differs from the first run
+def check_replay(runs: int, seed: int, directory: str) -> int:
+    rng = random.Random(seed)
+    failures = 0
+    first, second = os.path.join(directory, "first.sched"), os.path.join(directory, "second.sched")
+    for number in range(runs):
+        item_count = rng.choice((4, 16, 200))
+        files = generate(os.path.join(directory, "run" + str(number)), item_count, rng.randint(2, 40),
+                         rng.randint(1, 30), skew=rng.choice((0.0, 0.9)), seed=rng.randrange(1 << 30))
+        scheduler, victim = rng.choice(SCHEDULERS), rng.choice(sorted(VICTIM_POLICIES))
+        run_seed = rng.randrange(1 << 30)
+        where = ("replay: run " + str(number) + " (--seed " + str(seed) + ", " + scheduler + " scheduler, " +
+                 victim + " victims)")
+        result = record_run(item_count, files, scheduler, run_seed, victim, first)
+        if record_run(item_count, files, scheduler, run_seed, victim, second) != result:
+            failures += 1
+            print(where + ": the same run ended differently twice")
+            continue
+        with open(first, "rb") as file_a, open(second, "rb") as file_b:
+            if file_a.read() != file_b.read():
+                failures += 1
+                print(where + ": the same run wrote two different schedules")
+                continue
+        database, local = replay_run(item_count, files, first)
+        if database != result[0]:
+            failures += 1
+            print(where + ": the replayed database differs from the recorded run")
+        elif local != result[1]:
+            failures += 1
+            print(where + ": the replayed locals differ from the recorded run")
+    return failures
+
+
+def batch_run(item_count: int, files: List[str], vectorize: bool) -> Tuple[bytes, List[List[int]]]:
+    DB, transactions, Manager = setup(item_count, files)
+    batches, rest = plan(files)
+    run_batches(DB, Manager, transactions, batches + [rest], vectorize=vectorize)
+    return DB.snapshot().tobytes(), [transaction.local for transaction in transactions]
+
+
+# return the number of batches whose lockstep and one-at-a-time runs differ
+# the first batch always holds a program multiplying its way out of int64 range and back into it at a write
+def check_vectorized(batches: int, seed: int, directory: str) -> int:
+    rng = random.Random(seed)
+    failures = 0
+    for number in range(batches):
+        texts = [b"4 1\nR 0 0\nM 0 10000000000\nM 0 10000000000\nW 0 0\n"] if number == 0 else []
+        item_count = len(texts)
+        # every program gets items of its own, so the whole workload is one conflict-free batch
+        for _ in range(rng.randint(2, 12)):
+            own = rng.randint(1, 4)
+            texts.append(random_program(rng, own, rng.randint(1, 6), rng.randint(1, 40), item_count))
+            item_count += own
+        files = []
+        for i, text in enumerate(texts):
+            files.append(os.path.join(directory, "batch" + str(number) + "_" + str(i) + ".txt"))
+            with open(files[-1], "wb") as file:
+                file.write(text)
+        if batch_run(item_count, files, True) != batch_run(item_count, files, False):
+            failures += 1
+            print("vectorized: batch " + str(number) + " (--seed " + str(seed) + ") ends differently in lockstep\n" +
+                  "\n".join(text.decode() for text in texts))
+    return failures
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Check fused execution, schedule replay and lockstep batches against plain runs.")
+    parser.add_argument("--programs", type=int, default=3000, help="random transactions for the fused check")
+    parser.add_argument("--runs", type=int, default=200, help="random recorded runs for the replay check")
+    parser.add_argument("--batches", type=int, default=300, help="random conflict-free batches for the vectorized check")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the random programs and workloads")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+    tracer.configure(LEVELS["off"])
+    with tempfile.TemporaryDirectory() as directory:
+        fused_failures = check_fused(args.programs, args.seed, directory)
+        print("fused: " + str(args.programs - fused_failures) + " of " + str(args.programs) + " programs agree")
+        replay_failures = check_replay(args.runs, args.seed, directory)
+        print("replay: " + str(args.runs - replay_failures) + " of " + str(args.runs) + " runs replay identically")
+        vectorized_failures = 0
+        if vectorized.available():
+            vectorized_failures = check_vectorized(args.batches, args.seed, directory)
+            print("vectorized: " + str(args.batches - vectorized_failures) + " of " + str(args.batches) +
+                  " batches agree")
+        else:
+            print("vectorized: skipped, NumPy isn't installed")
+    sys.exit(fused_failures + replay_failures + vectorized_failures)
@@ -0,0 +1,108 @@
+from typing import Dict, List, Optional
+import sys
+import json
+import asyncio
+import argparse
+
+
+# README!!!
+# To send transaction files to a running server.py, do
+# python client.py --socket <path> <file 1> <file 2> ...
+# python client.py --port <n> [--host 127.0.0.1] <file 1> <file 2> ...
+
+
+# the text of a transaction file in the form the server reads: the header and exactly one line per command
+def transaction_text(file_name: str) -> bytes:
+    with open(file_name, "rb") as file:
+        header = file.readline()
+        commands = [line.strip() for line in file if line.strip()]
+    fields = header.split()
+    if len(fields) != 2:
+        raise ValueError(file_name + ":1: malformed header " + repr(header.decode(errors='replace')))
+    return b"\n".join([str(len(commands)).encode() + b" " + fields[1]] + commands) + b"\n"
+
+
+class Client:
+    # A connection to server.py. submit() can be called any number of times without waiting for the replies in
+    # between; the requests are pipelined over the one connection and every reply resolves the future of its request.
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.sent = 0
+        self.replies: Dict[int, asyncio.Future] = {}
+        self.receiver = asyncio.create_task(self._receive())
+
+    @classmethod
+    async def connect(cls, socket_path: Optional[str] = None, host: str = "127.0.0.1",
+                      port: Optional[int] = None) -> "Client":
+        if socket_path is not None:
+            reader, writer = await asyncio.open_unix_connection(socket_path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def _receive(self) -> None:
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                break
+            reply = json.loads(line)
+            future = self.replies.pop(reply["id"], None)
+            if future is not None and not future.done():
+                future.set_result(reply)
+        for future in self.replies.values():
+            if not future.done():
+                future.set_exception(ConnectionError("the server closed the connection"))
+        self.replies.clear()
+
+    # send a transaction in transaction file format and return the future of its reply
+    def submit(self, text: bytes) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self.replies[self.sent] = future
+        self.sent += 1
+        self.writer.write(text if text.endswith(b"\n") else text + b"\n")
+        return future
+
+    # send a transaction and wait for its reply, a dict with tid, committed, local and latency_ms (or error)
+    async def run(self, text: bytes) -> Dict:
+        future = self.submit(text)
+        await self.writer.drain()
+        return await future
+
+    async def close(self) -> None:
+        self.writer.close()
+        await self.writer.wait_closed()
+        self.receiver.cancel()
+
+
+# send every file over one pipelined connection and return the replies in file order
+async def run_files(files: List[str], socket_path: Optional[str] = None, host: str = "127.0.0.1",
+                    port: Optional[int] = None) -> List[Dict]:
+    client = await Client.connect(socket_path, host, port)
+    try:
+        futures = [client.submit(transaction_text(file_name)) for file_name in files]
+        await client.writer.drain()
+        return list(await asyncio.gather(*futures))
+    finally:
+        await client.close()
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Send transaction files to a running server.py.")
+    parser.add_argument("files", nargs="+", help="transaction files")
+    where = parser.add_mutually_exclusive_group(required=True)
+    where.add_argument("--socket", default=None, help="Unix domain socket of the server")
+    where.add_argument("--port", type=int, default=None, help="TCP port of the server")
+    parser.add_argument("--host", default="127.0.0.1", help="address of the server with --port")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+    for file_name, reply in zip(args.files, asyncio.run(run_files(args.files, args.socket, args.host, args.port))):
+        if "error" in reply:
+            print(file_name + ": error: " + reply["error"])
+        else:
+            print(file_name + ": T" + str(reply["tid"]) + (" committed" if reply["committed"] else " aborted") +
+                  ", local " + " ".join(str(value) for value in reply["local"]) +
+                  ", " + format(reply["latency_ms"], ".3f") + " ms")
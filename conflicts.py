@@ -0,0 +1,118 @@
+from typing import Dict, List, Set, Tuple
+
+from main import (Database, LockManager, Transaction, TransactionReader, ValueOutOfRange, OP_READ, OP_WRITE,
+                  execute_command, commit, rollback)
+from tracing import tracer, SUMMARY
+
+
+# Every transaction file is known before the run starts, so the items each one reads and writes are too.
+# Two transactions conflict if one of them writes an item the other reads or writes. Coloring the conflict graph
+# splits the transactions into batches in which no two conflict: any interleaving of a batch is equivalent to any
+# serial order of it, so a batch runs without a single lock request, one batch after the other. Colors with fewer
+# than min_batch transactions aren't worth a batch of their own; those transactions run afterwards under the
+# LockManager as usual.
+
+
+# the items a transaction file reads and the items it writes
+def access_sets(file_name: str) -> Tuple[Set[int], Set[int]]:
+    reader = TransactionReader(file_name)
+    reads: Set[int] = set()
+    writes: Set[int] = set()
+    while not reader.exhausted:
+        opcodes, operands1, operands2 = reader.read_chunk()
+        for opcode, operand1, operand2 in zip(opcodes, operands1, operands2):
+            if opcode == OP_READ:
+                reads.add(operand1)
+            elif opcode == OP_WRITE:
+                writes.add(operand2)
+    return reads, writes
+
+
+# {tid: tids it conflicts with}, built per item so transactions that share nothing are never compared
+def conflict_graph(sets: List[Tuple[Set[int], Set[int]]]) -> List[Set[int]]:
+    readers: Dict[int, List[int]] = {}
+    writers: Dict[int, List[int]] = {}
+    for tid, (reads, writes) in enumerate(sets):
+        for item in reads - writes:
+            readers.setdefault(item, []).append(tid)
+        for item in writes:
+            writers.setdefault(item, []).append(tid)
+    graph: List[Set[int]] = [set() for _ in sets]
+    for item, tids in writers.items():
+        others = tids + readers.get(item, [])
+        for writer in tids:
+            graph[writer].update(others)
+            for other in others:
+                graph[other].add(writer)
+    for tid, neighbours in enumerate(graph):
+        neighbours.discard(tid)
+    return graph
+
+
+# greedy coloring, most conflicting transaction first, each taking the lowest color none of its neighbours has
+# returns the color classes, largest first, each in tid order
+def color(graph: List[Set[int]]) -> List[List[int]]:
+    colors: List[int] = [-1] * len(graph)
+    classes: List[List[int]] = []
+    for tid in sorted(range(len(graph)), key=lambda tid: (-len(graph[tid]), tid)):
+        taken = {colors[neighbour] for neighbour in graph[tid]}
+        c = 0
+        while c in taken:
+            c += 1
+        colors[tid] = c
+        if c == len(classes):
+            classes.append([])
+        classes[c].append(tid)
+    for tids in classes:
+        tids.sort()
+    classes.sort(key=len, reverse=True)
+    return classes
+
+
+# split the transaction files into conflict-free batches and the tids left for the lock manager
+def plan(files: List[str], min_batch: int = 2) -> Tuple[List[List[int]], List[int]]:
+    batches: List[List[int]] = []
+    rest: List[int] = []
+    for tids in color(conflict_graph([access_sets(file_name) for file_name in files])):
+        if len(tids) >= min_batch:
+            batches.append(tids)
+        else:
+            rest.extend(tids)
+    rest.sort()
+    return batches, rest
+
+
+# run one transaction to completion without requesting a lock, aborting it at a write of a value out of range
+def run_alone(DB: Database, Manager: LockManager, transaction: Transaction, tid: int, recorder=None) -> None:
+    try:
+        while not transaction.finished():
+            opcode, operand1, operand2 = transaction.current()
+            execute_command(DB, Manager, transaction, tid, opcode, operand1, operand2)
+            if recorder is not None:
+                recorder.step(tid, True)
+    except ValueOutOfRange as error:
+        tracer.event(SUMMARY, str(error) + ", abort T" + str(tid))
+        if recorder is not None:
+            recorder.abort(tid)
+        rollback(DB, tid)
+        transaction.abort()
+        Manager.releaseAll(tid)
+    else:
+        commit(DB, Manager, tid)
+
+
+# run every transaction of every batch to completion without requesting a lock; Manager only keeps the work counts
+# a recorder (schedule.ScheduleRecorder) gets every step, so a replay of the run covers the batches too
+# with vectorize, each batch runs in lockstep on the vectorized interpreter instead, when NumPy is there and the run
+# isn't being recorded; the transactions it hands back run alone afterwards
+def run_batches(DB: Database, Manager: LockManager, transactions: List[Transaction], batches: List[List[int]],
+                recorder=None, vectorize: bool = False) -> None:
+    if vectorize:
+        import vectorized
+        vectorize = vectorized.available() and recorder is None
+    for number, tids in enumerate(batches, 1):
+        tracer.event(SUMMARY, "Batch " + str(number) + " without locks: T" + ", T".join(str(tid) for tid in tids))
+        if vectorize:
+            tids = vectorized.run_batch(DB, Manager, transactions, tids)
+        for tid in tids:
+            run_alone(DB, Manager, transactions[tid], tid, recorder)
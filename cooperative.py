@@ -0,0 +1,232 @@
+from typing import Dict, List, Optional
+import sys
+import asyncio
+import argparse
+
+from main import (Database, Transaction, ValueOutOfRange, VICTIM_POLICIES, OP_READ, OP_WRITE, execute_command,
+                  setup, commit, rollback)
+from server import AsyncLockManager, wait_durable
+from threaded import TransactionAborted, RunResult, check_serializable
+from tracing import tracer, LEVELS, SUMMARY
+
+
+# README!!!
+# To run every transaction as a coroutine on one asyncio event loop, do
+# python cooperative.py <number of elements in the database> <file 1> <file 2> ...
+# optional: --deadlock detect|timeout|wait-die --timeout <ms> --victim youngest|fewest_locks|least_work
+#           --concurrency <n> --yield-every <n> --trace off|summary|locks|full --check
+#
+# No threads: a transaction gives up the loop while it waits for a lock, and every --yield-every commands otherwise,
+# which is what interleaves them. An aborted transaction rolls back, waits until the transactions it was waiting
+# for have committed, and starts over with its first timestamp until it commits.
+
+DEADLOCK_SCHEMES = ("detect", "timeout", "wait-die")
+
+
+class CooperativeLockManager(AsyncLockManager):
+    # An AsyncLockManager that settles deadlocks by one of DEADLOCK_SCHEMES:
+    # detect: the waits-for detector aborts a victim of every cycle, as in main.py
+    # timeout: no detector, a waiter still parked timeout seconds (on the loop clock) after its request is aborted
+    # wait-die: a transaction may only wait for younger ones, so no cycle can form; one that would wait for an older
+    # one dies instead, also when an older upgrade jumps the queue ahead of it while it waits
+    # a timeout given with the other two schemes aborts long waits on top of them
+    # Every attempt of a transaction keeps the timestamp of its first one, for wait-die and for the victim policies
+    # of detect alike, so a restarted transaction only gets older and can't lose every conflict forever.
+    def __init__(self, DB: Database, victim_policy: str = "youngest", scheme: str = "detect",
+                 timeout: Optional[float] = None):
+        super().__init__(DB, victim_policy)
+        self.scheme = scheme
+        self.timeout = timeout
+        # wait-die uses the detector's list of waiters whose edges changed, only the check differs
+        self.detect_deadlocks = scheme != "timeout"
+        # {tid: order it first began in}, kept across restarts
+        self.timestamps: Dict[int, int] = {}
+        # {tid: future resolved once it has committed or given up for good}
+        self.done: Dict[int, asyncio.Future] = {}
+        # {aborted tid: done of every transaction it was waiting for when it was aborted}
+        self.blockers: Dict[int, List[asyncio.Future]] = {}
+
+    # start an attempt of tid; LockManager.releaseAll drops tid's start order, so it is put back every time
+    def begin(self, tid: int) -> None:
+        self.started[tid] = self.timestamps.setdefault(tid, len(self.timestamps))
+        if tid not in self.done:
+            self.done[tid] = asyncio.get_running_loop().create_future()
+
+    # tid won't run again, committed or not
+    def finish(self, tid: int) -> None:
+        done = self.done.pop(tid, None)
+        if done is not None and not done.done():
+            done.set_result(None)
+
+    # every scheme aborts a transaction while it waits, so what it waits for is still known here
+    def _abort_waiter(self, tid: int) -> None:
+        done = self.done
+        self.blockers[tid] = [done[blocker] for blocker in self.waits_for.get(tid, ()) if blocker in done]
+        super()._abort_waiter(tid)
+
+    # before an aborted tid starts over, wait until the transactions that were in its way have finished, so it
+    # doesn't run into the same conflict again right away. A transaction backing off holds no locks and waits for
+    # no one, so it can't be in the way of another one that is aborted later: these waits never form a cycle.
+    async def back_off(self, tid: int) -> None:
+        blockers = self.blockers.pop(tid, None)
+        if blockers:
+            await asyncio.wait(blockers)
+        else:
+            await asyncio.sleep(0)
+
+    def _check_deadlocks(self) -> None:
+        if self.scheme != "wait-die":
+            super()._check_deadlocks()
+            return
+        if self._checking:
+            return
+        self._checking = True
+        try:
+            timestamps = self.timestamps
+            while self._suspects:
+                tid = self._suspects.pop()
+                if tid in self.waiting and any(timestamps[blocker] < timestamps[tid]
+                                               for blocker in self.waits_for.get(tid, ())):
+                    tracer.event(SUMMARY, "T" + str(tid) + " waits for an older transaction, abort")
+                    self.on_abort(tid)
+                    self.releaseAll(tid)
+        finally:
+            self._checking = False
+
+    # a waiter still parked when its timer fires is presumed deadlocked
+    def _expire(self, tid: int, k: int) -> None:
+        if self.waiting.get(tid) == k:
+            tracer.event(SUMMARY, "Lock wait on item " + str(k) + " timed out, abort T" + str(tid))
+            self.on_abort(tid)
+            self.releaseAll(tid)
+
+    async def acquire(self, tid: int, k: int, is_s_lock: bool) -> None:
+        if self.request(tid, k, is_s_lock):
+            return
+        if tid in self.aborted:
+            raise TransactionAborted(tid)
+        if tid not in self.waiting:
+            return
+        loop = asyncio.get_running_loop()
+        future = self.wakeups[tid] = loop.create_future()
+        expiry = loop.call_later(self.timeout, self._expire, tid, k) if self.timeout is not None else None
+        try:
+            await future
+        finally:
+            if expiry is not None:
+                expiry.cancel()
+
+
+# run one transaction until it commits, starting it over every time it is aborted
+# a committed tid is appended to result.commit_order while its locks are still held, every aborted attempt to
+# result.aborted, and its latency from the first start to the commit, on the loop clock, to result.latencies
+# a transaction cancelled from outside, or one writing a value out of int64 range, rolls back and is not restarted
+async def run_transaction(db: Database, manager: CooperativeLockManager, transaction: Transaction, tid: int,
+                          result: RunResult, yield_every: int = 1) -> None:
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    while True:
+        manager.begin(tid)
+        committed = restart = False
+        try:
+            steps = 0
+            while not transaction.finished():
+                opcode, operand1, operand2 = transaction.current()
+                if opcode == OP_READ:
+                    await manager.acquire(tid, operand1, True)
+                elif opcode == OP_WRITE:
+                    await manager.acquire(tid, operand2, False)
+                execute_command(db, manager, transaction, tid, opcode, operand1, operand2)
+                steps += 1
+                if steps == yield_every:
+                    steps = 0
+                    await asyncio.sleep(0)
+            result.commit_order.append(tid)
+            lsn = commit(db, manager, tid)
+            committed = True
+            await wait_durable(db, lsn)
+        except TransactionAborted:
+            # the lock manager has already rolled it back
+            result.aborted.append(tid)
+            restart = True
+        except ValueOutOfRange as error:
+            # it would write the same value again on every restart, so it stays aborted
+            tracer.event(SUMMARY, str(error) + ", abort T" + str(tid))
+            rollback(db, tid)
+            transaction.abort()
+            result.aborted.append(tid)
+            return
+        except BaseException:
+            rollback(db, tid)
+            raise
+        finally:
+            if not committed:
+                manager.releaseAll(tid)
+            manager.forget(tid)
+            if not restart:
+                manager.finish(tid)
+        if committed:
+            break
+        transaction.restart()
+        await manager.back_off(tid)
+    result.latencies.append(loop.time() - start)
+
+
+# run every transaction as its own task on the running loop, at most concurrency of them at once (0 for all)
+async def run_cooperative(db: Database, manager: CooperativeLockManager, transactions: List[Transaction],
+                          concurrency: int = 0, yield_every: int = 1) -> RunResult:
+    result = RunResult()
+    loop = asyncio.get_running_loop()
+    limit = asyncio.Semaphore(concurrency) if concurrency > 0 else None
+
+    async def work(tid: int) -> None:
+        if limit is None:
+            await run_transaction(db, manager, transactions[tid], tid, result, yield_every)
+            return
+        async with limit:
+            await run_transaction(db, manager, transactions[tid], tid, result, yield_every)
+
+    start = loop.time()
+    await asyncio.gather(*(work(tid) for tid in range(len(transactions))))
+    result.elapsed = loop.time() - start
+    return result
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run transaction files as coroutines on one asyncio event loop.")
+    parser.add_argument("item_count", type=int, help="number of elements in the database")
+    parser.add_argument("files", nargs="+", help="transaction files")
+    parser.add_argument("--deadlock", choices=DEADLOCK_SCHEMES, default="detect",
+                        help="detect waits-for cycles, abort lock waits that time out, or wait-die")
+    parser.add_argument("--timeout", type=float, default=None,
+                        help="abort a transaction that waits longer than this many ms for a lock "
+                             "(100 by default with --deadlock timeout)")
+    parser.add_argument("--victim", choices=sorted(VICTIM_POLICIES), default="youngest",
+                        help="which transaction of a deadlock cycle to abort")
+    parser.add_argument("--concurrency", type=int, default=0, help="transactions running at once, 0 for all of them")
+    parser.add_argument("--yield-every", type=int, default=1,
+                        help="commands a transaction runs before letting the others go on, 0 to only give way on "
+                             "lock waits")
+    parser.add_argument("--trace", choices=list(LEVELS), default="summary", help="how much of the run to trace")
+    parser.add_argument("--check", action="store_true",
+                        help="check the final database against a serial run in commit order")
+    args = parser.parse_args(argv)
+    if args.timeout is None and args.deadlock == "timeout":
+        args.timeout = 100.0
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+    tracer.configure(LEVELS[args.trace])
+    DB, transactions, _ = setup(args.item_count, args.files)
+    Manager = CooperativeLockManager(DB, args.victim, args.deadlock,
+                                     args.timeout / 1000 if args.timeout is not None else None)
+    result = asyncio.run(run_cooperative(DB, Manager, transactions, args.concurrency, args.yield_every))
+    tracer.flush()
+    print(result.summary())
+    if args.check:
+        tracer.configure(LEVELS["off"])
+        serializable = check_serializable(args.item_count, args.files, DB, result)
+        print("serializable:", serializable)
+    DB.print()
@@ -0,0 +1,258 @@
+from typing import Deque, Dict, List, Optional, Set, Tuple
+from collections import deque
+
+from main import Database, LockManager
+from tracing import tracer, LOCKS
+
+# lock modes of a page
+IS, IX, S, SIX, X = "IS", "IX", "S", "SIX", "X"
+# {held mode: modes another transaction can be granted next to it}
+COMPATIBLE: Dict[str, Set[str]] = {
+    IS: {IS, IX, S, SIX},
+    IX: {IS, IX},
+    S: {IS, S},
+    SIX: {IS},
+    X: set(),
+}
+
+
+# the weakest page mode that allows everything held and everything wanted allow
+def combine(held: Optional[str], wanted: str) -> str:
+    if held is None or held == wanted or held == IS:
+        return wanted
+    if wanted == IS:
+        return held
+    if X in (held, wanted):
+        return X
+    # any two of IX, S and SIX
+    return SIX
+
+
+# whether a page lock in mode held already covers an item lock of the given kind on every item of the page
+def covers(held: Optional[str], is_s_lock: bool) -> bool:
+    return held == X or (is_s_lock and (held == S or held == SIX))
+
+
+class PageLock:
+    # the lock record of a page of page_size consecutive items
+    # holders is the set of tids holding the page in any mode, modes maps them to that mode,
+    # queue holds the (tid, mode) requests waiting for the page in FIFO order,
+    # upgrades the holders waiting for a stronger mode in FIFO order, all served before anything in queue,
+    # and wanted the mode each of them waits for
+    __slots__ = ("holders", "modes", "queue", "upgrades", "wanted")
+
+    def __init__(self):
+        self.holders: Set[int] = set()
+        self.modes: Dict[int, str] = {}
+        self.queue: Deque[Tuple[int, str]] = deque()
+        self.upgrades: Deque[int] = deque()
+        self.wanted: Dict[int, str] = {}
+
+    def compatible(self, tid: int, mode: str) -> bool:
+        return all(mode in COMPATIBLE[held] for holder, held in self.modes.items() if holder != tid)
+
+    # drop whatever lock tid holds on the page, and the upgrade it may have been waiting for
+    def release(self, tid: int) -> None:
+        self.holders.discard(tid)
+        self.modes.pop(tid, None)
+        self.wanted.pop(tid, None)
+
+
+class HierarchicalLockManager(LockManager):
+    # Multi-granularity locking on top of the per-item S/X locks.
+    # The items are split into pages of page_size items. Before an item is locked, its page is locked in IS (for an
+    # S-lock) or IX (for an X-lock) mode; a transaction holding the page in S, SIX or X mode doesn't lock the items
+    # it covers at all. Once a transaction holds more than escalate_after item locks in one page, they are traded for
+    # a single S or X lock on the page if that can be granted right away.
+    # Page locks live in the same lock table and per-transaction index as item locks, under the keys
+    # item_count + page, so waiting, the waits-for graph, deadlock detection and releaseAll treat both alike.
+    def __init__(self, DB: Database, victim_policy: str = "youngest", page_size: int = 64, escalate_after: int = 32):
+        super().__init__(DB, victim_policy)
+        self.page_size = page_size
+        # 0 turns escalation off
+        self.escalate_after = escalate_after
+        self.page_base = self.item_count
+        # {tid: {page key: item locks held in that page}}
+        self.fine_locks: Dict[int, Dict[int, int]] = {}
+
+    def page_key(self, item: int) -> int:
+        return self.page_base + item // self.page_size
+
+    # same contract as LockManager.request, with the page intention lock taken first
+    def request(self, tid: int, k: int, is_s_lock: bool) -> int:
+        held = self.transaction_locks.get(tid, {}).get(k)
+        if held is not None and (is_s_lock or not held):
+            # the item lock itself is enough, which is LockManager's fast path
+            return super().request(tid, k, is_s_lock)
+        if not 0 <= k < self.item_count:
+            raise IndexError("item " + str(k) + " is not in the database")
+        if tid not in self.started:
+            self.started[tid] = next(self.start_order)
+        key = self.page_key(k)
+        held = self.transaction_locks.get(tid, {}).get(key)
+        if covers(held, is_s_lock):
+            # the page lock already covers the item: granted like LockManager's fast path, and counted like it
+            if tracer.level >= LOCKS:
+                tracer.lock(tid, k, is_s_lock, True)
+            if self.metrics is not None:
+                self.metrics.request(tid, k, True, False)
+            return 1
+        if not self._request_page(tid, key, combine(held, IS if is_s_lock else IX)):
+            return 0
+        if not super().request(tid, k, is_s_lock):
+            return 0
+        if self.escalate_after and self.fine_locks.get(tid, {}).get(key, 0) > self.escalate_after:
+            self._escalate(tid, key)
+        return 1
+
+    # ask for page key in mode, queueing tid if it can't be granted
+    def _request_page(self, tid: int, key: int, mode: str) -> bool:
+        held = self.transaction_locks.get(tid, {}).get(key)
+        if held == mode:
+            return True
+        if tid in self.waiting:
+            return False
+        entry = self.lock_table.get(key)
+        if entry is None:
+            entry = self.lock_table[key] = PageLock()
+        if entry.compatible(tid, mode) and (held is not None or not (entry.queue or entry.upgrades)):
+            self._grant_page(tid, key, mode)
+            granted = True
+            if entry.queue or entry.upgrades:
+                # an upgrade granted past the waiters can make it block more of them
+                self._update_edges(key)
+                self._check_deadlocks()
+        else:
+            # upgrades wait on their own queue ahead of the new requests, like item upgrades
+            if held is not None:
+                entry.upgrades.append(tid)
+                entry.wanted[tid] = mode
+            else:
+                entry.queue.append((tid, mode))
+            self._park(tid, key)
+            granted = False
+        if tracer.level >= LOCKS:
+            tracer.event(LOCKS, "T%d request %s-lock on page %d: %s" % (tid, mode, key - self.page_base,
+                                                                        "G" if granted else "D"))
+        if not granted:
+            self._check_deadlocks()
+        return granted
+
+    def _grant_page(self, tid: int, key: int, mode: str) -> None:
+        entry = self.lock_table.get(key)
+        if entry is None:
+            entry = self.lock_table[key] = PageLock()
+        entry.holders.add(tid)
+        entry.modes[tid] = mode
+        self.transaction_locks.setdefault(tid, {})[key] = mode
+
+    # page waiters are granted through here too, with their mode in place of is_s_lock
+    def _grant(self, tid: int, k: int, is_s_lock) -> None:
+        if k >= self.page_base:
+            self._grant_page(tid, k, is_s_lock)
+            return
+        if k not in self.transaction_locks.get(tid, {}):
+            pages = self.fine_locks.setdefault(tid, {})
+            key = self.page_key(k)
+            pages[key] = pages.get(key, 0) + 1
+        super()._grant(tid, k, is_s_lock)
+
+    # trade tid's item locks in page key for one page lock, if nobody has to wait for it
+    def _escalate(self, tid: int, key: int) -> None:
+        # IS means tid only S-locked items of the page, otherwise at least one of them is X-locked
+        mode = S if self.transaction_locks[tid][key] == IS else X
+        entry = self.lock_table[key]
+        if entry.queue or entry.upgrades or not entry.compatible(tid, mode):
+            return
+        self._grant_page(tid, key, mode)
+        if tracer.level >= LOCKS:
+            tracer.event(LOCKS, "T%d escalate to %s-lock on page %d" % (tid, mode, key - self.page_base))
+        self._release_covered(tid, key)
+
+    # release tid's item locks in page key that its page lock now covers
+    def _release_covered(self, tid: int, key: int) -> None:
+        locks = self.transaction_locks[tid]
+        mode = locks[key]
+        page = key - self.page_base
+        size = self.page_size
+        covered = [item for item, is_s_lock in locks.items()
+                   if item < self.page_base and item // size == page and covers(mode, is_s_lock)]
+        for item in covered:
+            del locks[item]
+            self.lock_table[item].release(tid)
+            self._grant_waiters(item)
+            self._drop_if_unused(item)
+        pages = self.fine_locks.get(tid)
+        if pages is not None and key in pages:
+            pages[key] -= len(covered)
+
+    # page upgrades are handed out first, earliest first, then the queue, each with the mode it waits for
+    # unlike an item upgrade, a page upgrade can fit next to other holders, so one that fits is granted even while
+    # an earlier one still waits; it holds the page already and would only wait for that one invisibly otherwise
+    def _grant_waiters(self, k: int) -> None:
+        if k < self.page_base:
+            super()._grant_waiters(k)
+            return
+        entry = self.lock_table[k]
+        upgrades, wanted = entry.upgrades, entry.wanted
+        for tid in list(upgrades):
+            if entry.compatible(tid, wanted[tid]):
+                upgrades.remove(tid)
+                self._hand_over(tid, k, wanted.pop(tid))
+        queue = entry.queue
+        while queue and not upgrades:
+            tid, mode = queue[0]
+            if not entry.compatible(tid, mode):
+                break
+            queue.popleft()
+            self._hand_over(tid, k, mode)
+        self._update_edges(k)
+
+    def _update_edges(self, k: int) -> None:
+        if k < self.page_base:
+            super()._update_edges(k)
+            return
+        # an upgrader waits for the holders its new mode conflicts with; pages are handed out strictly in queue
+        # order, so a queued waiter also waits for every upgrader and everyone queued ahead of it, even when their
+        # modes are compatible
+        entry = self.lock_table[k]
+        for tid in entry.upgrades:
+            blockers = set(self.conflicting_holders(k, tid, entry.wanted[tid]))
+            if blockers != self.waits_for.get(tid):
+                self.waits_for[tid] = blockers
+                if self.detect_deadlocks:
+                    self._suspects.append(tid)
+        ahead: List[int] = list(entry.upgrades)
+        for tid, mode in entry.queue:
+            blockers = set(self.conflicting_holders(k, tid, mode))
+            blockers.update(ahead)
+            ahead.append(tid)
+            if blockers != self.waits_for.get(tid):
+                self.waits_for[tid] = blockers
+                if self.detect_deadlocks:
+                    self._suspects.append(tid)
+
+    def releaseAll(self, tid: int) -> int:
+        self.fine_locks.pop(tid, None)
+        return super().releaseAll(tid)
+
+    # for a page key, is_s_lock is the mode asked for
+    def conflicting_holders(self, item: int, tid: int, is_s_lock) -> List[int]:
+        if item < self.page_base:
+            return super().conflicting_holders(item, tid, is_s_lock)
+        entry = self.lock_table.get(item)
+        if entry is None:
+            return []
+        return [holder for holder, held in entry.modes.items() if holder != tid and is_s_lock not in COMPATIBLE[held]]
+
+    def has_x_lock_on(self, item: int, tid: int) -> bool:
+        if super().has_x_lock_on(item, tid):
+            return True
+        entry = self.lock_table.get(self.page_key(item))
+        return entry is not None and any(holder != tid and held == X for holder, held in entry.modes.items())
+
+    def can_grant_x(self, item: int, tid: int) -> bool:
+        if not super().can_grant_x(item, tid):
+            return False
+        entry = self.lock_table.get(self.page_key(item))
+        return entry is None or entry.compatible(tid, IX)
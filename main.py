@@ -1,16 +1,76 @@
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, Set, Optional, Deque, Callable
+import os
+import re
 import sys
-import random
+import mmap
+import argparse
+import itertools
+from collections import deque
+from array import array
+
+from scheduler import Scheduler, SCHEDULERS, make_scheduler
+from tracing import tracer, LEVELS, SUMMARY, LOCKS, FULL
+from wal import LogManager, FLUSH_POLICIES, recover
 
 # README!!!
 # To run this program, do
 # python main.py <number of elements in the database> <file 1> <file 2> ...
+# optional: --mode 2pl|mvcc|occ --batch-size <n> --scheduler random|round-robin|shortest --seed <n>
+#           --preschedule --min-batch <n> --vectorize
+#           --victim youngest|fewest_locks|least_work --record <path> --replay <path>
+#           --page-size <n> --escalate-after <n> --metrics <path.json|path.csv> --metrics-sample <n> --top <n>
+#           --trace off|summary|locks|full --trace-file <path> --db-file <path>
+#           --wal <path> --flush-policy always|group|none --group-size <n> --group-interval <ms> --checkpoint-every <n>
+
+
+# the values a database item can hold
+INT64_MIN, INT64_MAX = -(1 << 63), (1 << 63) - 1
+
+
+class ValueOutOfRange(ValueError):
+    # raised when a transaction writes a value an int64 item can't hold; the executor aborts that transaction
+    def __init__(self, tid: int, k: int, value: int):
+        super().__init__("T" + str(tid) + " writes " + str(value) + " to db[" + str(k) + "], which only holds " +
+                         str(INT64_MIN) + ".." + str(INT64_MAX))
+        self.tid = tid
+
+
+# raise ValueOutOfRange unless value fits in an item
+def check_value(tid: int, k: int, value: int) -> None:
+    if not INT64_MIN <= value <= INT64_MAX:
+        raise ValueOutOfRange(tid, k, value)
 
 
 class Database:
-    def __init__(self, k: int, nonzero: bool):
-        # database to store k integers
-        self.database = [i + 1 for i in range(k)] if nonzero else [0] * k
+    # database to store k integers as packed int64s
+    # in memory by default, or in a file mapped with mmap when path is given: an existing file of the same size is
+    # reopened as it is, so a database is built once and then shared by every process that maps the same file;
+    # an empty or missing file is created and filled, a file of any other size is an error
+    def __init__(self, k: int, nonzero: bool, path: Optional[str] = None):
+        self.path = path
+        self.mapping: Optional[mmap.mmap] = None
+        # keeps the before images of every running transaction so aborts can be undone;
+        # attach_log() swaps in one that also writes a log file
+        self.wal: Optional[LogManager] = LogManager()
+        if path is None:
+            self.database = array('q', range(1, k + 1)) if nonzero else array('q', bytes(8 * k))
+            return
+        with open(path, "a+b") as file:
+            size = os.fstat(file.fileno()).st_size
+            if size != 8 * k and size != 0:
+                raise ValueError(path + " holds " + str(size // 8) + " items (" + str(size) + " bytes), not " +
+                                 str(k))
+            fresh = size == 0
+            if fresh:
+                file.truncate(8 * k)
+            # an empty file can't be mapped, a 0-item database just keeps an empty array
+            if k == 0:
+                self.database = array('q')
+                return
+            self.mapping = mmap.mmap(file.fileno(), 8 * k)
+        self.database = memoryview(self.mapping).cast('q')
+        if fresh:
+            fill(self.database, nonzero)
 
     def read(self, k: int) -> int:
         return self.database[k]
@@ -18,128 +78,589 @@ class Database:
     def write(self, k: int, w: int) -> None:
         self.database[k] = w
 
+    # a copy of every item, taken in one bulk copy
+    def snapshot(self) -> array:
+        values = array('q')
+        values.frombytes(memoryview(self.database).cast('B'))
+        return values
+
+    # write every item to path as raw int64s, the format a file-backed Database maps
+    def export(self, path: str) -> None:
+        with open(path, "wb") as file:
+            file.write(memoryview(self.database).cast('B'))
+
+    # push the items of a file-backed database to disk
+    def flush(self) -> None:
+        if self.mapping is not None:
+            self.mapping.flush()
+
+    def close(self) -> None:
+        if self.wal is not None:
+            self.wal.close()
+        if self.mapping is not None:
+            self.mapping.flush()
+            self.database.release()
+            self.mapping.close()
+            self.mapping = None
+
+    def format(self) -> str:
+        return "Database: " + str(self.database.tolist())
+
     def print(self) -> None:
-        print("Database:", self.database)
+        print(self.format())
+
+
+# set the k items of an int64 buffer to 1..k, or to 0, a million items per slice assignment
+def fill(items: memoryview, nonzero: bool, block: int = 1 << 20) -> None:
+    for start in range(0, len(items), block):
+        end = min(start + block, len(items))
+        items[start:end] = array('q', range(start + 1, end + 1)) if nonzero else array('q', bytes(8 * (end - start)))
+
+
+class ItemLock:
+    # the lock record of a single data item
+    # holders is the set of tids holding any lock on the item,
+    # x_owner is the tid holding the X-lock (None if the item is only S-locked or unlocked),
+    # queue holds the (tid, is_s_lock) requests waiting for the item in FIFO order,
+    # upgrades the S-lock holder waiting to upgrade to an X-lock, served before anything in queue; never more than one,
+    # LockManager._upgrade aborts a second upgrader right away
+    __slots__ = ("holders", "x_owner", "queue", "upgrades")
+
+    def __init__(self):
+        self.holders: Set[int] = set()
+        self.x_owner: Optional[int] = None
+        self.queue: Deque[Tuple[int, bool]] = deque()
+        self.upgrades: Deque[int] = deque()
+
+    # "X" if the item is X-locked, "S" if it is only S-locked, None if nobody holds it
+    @property
+    def mode(self) -> Optional[str]:
+        if self.x_owner is not None:
+            return "X"
+        return "S" if self.holders else None
+
+    # whether tid could hold the lock right now, ignoring the waiters
+    def compatible(self, tid: int, is_s_lock: bool) -> bool:
+        if is_s_lock:
+            return self.x_owner is None or self.x_owner == tid
+        holders = self.holders
+        return not holders or (len(holders) == 1 and tid in holders)
+
+    # drop whatever lock tid holds on the item
+    def release(self, tid: int) -> None:
+        self.holders.discard(tid)
+        if self.x_owner == tid:
+            self.x_owner = None
+
+
+# deadlock victim policies: given the transactions on a waits-for cycle, pick the one to abort
+def youngest_victim(manager: "LockManager", cycle: List[int]) -> int:
+    # the transaction that made its first lock request last
+    return max(cycle, key=lambda tid: manager.started.get(tid, 0))
+
+
+def fewest_locks_victim(manager: "LockManager", cycle: List[int]) -> int:
+    # the transaction that has the fewest locks to give back
+    return min(cycle, key=lambda tid: (len(manager.transaction_locks.get(tid, ())), -manager.started.get(tid, 0)))
+
+
+def least_work_victim(manager: "LockManager", cycle: List[int]) -> int:
+    # the transaction that has executed the fewest instructions so far
+    return min(cycle, key=lambda tid: (manager.work_done.get(tid, 0), -manager.started.get(tid, 0)))
+
+
+VICTIM_POLICIES: Dict[str, Callable[["LockManager", List[int]], int]] = {
+    "youngest": youngest_victim,
+    "fewest_locks": fewest_locks_victim,
+    "least_work": least_work_victim,
+}
 
 
 class LockManager:
-    def __init__(self, DB: Database):
-        # We need to create a lock table based on the data items in the DB
-        # {data item: list of transaction ids holding the lock on this data item}
-        self.lock_table: Dict[int, List[int]] = {i: [] for i in range(len(DB.database))}
-        # Also create a table to see which transaction has which locks to make it more efficient
-        # it's a dictionary where each tid has a list of tuples: int contains the index to be locked,
-        # bool is whether it's an S-Lock: True for S-lock, False for X-lock
-        self.transaction_locks: Dict[int, List[Tuple[int, bool]]] = {}
+    def __init__(self, DB: Database, victim_policy: str = "youngest"):
+        # lock table: {data item: ItemLock}
+        # records are created the first time an item is locked and dropped when the last holder leaves,
+        # so the table only ever grows with the number of locked items, not with the size of the DB
+        self.item_count = len(DB.database)
+        self.lock_table: Dict[int, ItemLock] = {}
+        # per-transaction lock index: {tid: {data item: is_s_lock}}
+        # True for S-lock, False for X-lock; releasing a transaction only walks this index
+        self.transaction_locks: Dict[int, Dict[int, bool]] = {}
+        # {tid: data item} for every transaction parked on an item's wait queue
+        self.waiting: Dict[int, int] = {}
+        # called with the tid of every waiter that gets its lock, so a scheduler can mark it runnable
+        self.on_wake: Optional[Callable[[int], None]] = None
+        # waits-for graph: {waiting tid: tids it waits for}
+        # only the edges of the waiters of an item are rebuilt when that item's holders or queue change
+        self.waits_for: Dict[int, Set[int]] = {}
+        # the waiters whose edges changed since the last cycle check
+        # callers that prevent deadlocks themselves (wait-die, wound-wait) can turn the detector off
+        self.detect_deadlocks = True
+        self._suspects: List[int] = []
+        self._checking = False
+        # deadlock victims are picked by victim_policy and reported through on_abort, which can still undo their
+        # writes under their X-locks, and then released here
+        self.victim_policy = VICTIM_POLICIES[victim_policy]
+        self.on_abort: Optional[Callable[[int], None]] = None
+        # {tid: order of its first request} and {tid: instructions executed}, used by the victim policies
+        # the order comes from a counter rather than len(started), which releaseAll shrinks, so it never repeats
+        self.started: Dict[int, int] = {}
+        self.start_order = itertools.count()
+        self.work_done: Dict[int, int] = {}
+        # optional metrics.LockMetrics counting requests, grants, denials, upgrades and waits
+        self.metrics = None
 
     # transaction id, kth integer of the database, if the request is for a S-lock
     # return 1 if lock is granted, 0 if not
+    # a denied request parks tid on the item's wait queue until releaseAll hands it the lock,
+    # or until tid is picked as the victim of a deadlock
     def request(self, tid: int, k: int, is_s_lock: bool) -> int:
-        granted = False
-        # if we can grant this lock, we need to first release all lock held previously by this tid
-        if is_s_lock:
-            # if no other transaction has an X-lock
-            if not self.has_x_lock_on(k, tid):
-                granted = True
-                self.lock_table[k].append(tid)
-                self.transaction_locks.setdefault(tid, []).append((k, True))
+        locks = self.transaction_locks.get(tid)
+        held = locks.get(k) if locks is not None else None
+        if held is not None and (is_s_lock or not held):
+            # fast path: tid's own lock index says it already holds a lock at least as strong as the one asked for,
+            # so a loop over a few hot items doesn't touch the lock table at all
+            if tracer.level >= LOCKS:
+                tracer.lock(tid, k, is_s_lock, True)
+            if self.metrics is not None:
+                self.metrics.request(tid, k, True, False)
+            return 1
+        if not 0 <= k < self.item_count:
+            raise IndexError("item " + str(k) + " is not in the database")
+        if tid not in self.started:
+            self.started[tid] = next(self.start_order)
+        entry = self.lock_table.get(k)
+        if entry is None:
+            entry = self.lock_table[k] = ItemLock()
+        if tid in self.waiting:
+            # still parked on a queue, the lock is handed over by releaseAll
+            granted = False
+        elif held is not None:
+            granted = self._upgrade(entry, tid, k)
+        elif entry.compatible(tid, is_s_lock) and not entry.queue and not entry.upgrades:
+            # new requests also wait behind queued ones, so X-lock waiters are not starved by readers
+            self._grant(tid, k, is_s_lock)
+            granted = True
         else:
-            # if it's an x-lock, we need to first check if any other transactions has any lock on k
-            if not self.has_lock_on(k, tid):
-                granted = True
-                # see if the current tid holds a lock on k already
-                if tid in self.lock_table[k]:
-                    for i, (curr_k, curr_is_s_lock) in enumerate(self.transaction_locks[tid]):
-                        if curr_k == k:
-                            # update to an X-lock
-                            self.transaction_locks[tid][i] = (k, False)
-                # if the current tid does not hold a lock on k
-                else:
-                    self.lock_table[k].append(tid)
-                    self.transaction_locks.setdefault(tid, []).append((k, False))
-        statement = "T" + str(tid) + " request " + ("S" if is_s_lock else "X") + "-lock on item " + str(
-            k) + ": " + ("G" if granted else "D")
-        print(statement)
+            self._enqueue(entry, tid, k, is_s_lock)
+            granted = False
+        if tracer.level >= LOCKS:
+            tracer.lock(tid, k, is_s_lock, granted)
+        if self.metrics is not None:
+            self.metrics.request(tid, k, granted, held is True and not is_s_lock)
+        if not granted:
+            if tid not in self.waiting:
+                # the second upgrader of an item, which _upgrade refused to park; on_abort still sees the edges to the
+                # holders it would have waited for, releaseAll drops them
+                self.abort(tid)
+            self._check_deadlocks()
         return 1 if granted else 0
 
-    # release all locks held by transaction tid
+    # record a lock on k for tid, upgrading an S-lock held by tid to an X-lock if needed
+    def _grant(self, tid: int, k: int, is_s_lock: bool) -> None:
+        entry = self.lock_table.get(k)
+        if entry is None:
+            entry = self.lock_table[k] = ItemLock()
+        entry.holders.add(tid)
+        if not is_s_lock:
+            entry.x_owner = tid
+        self.transaction_locks.setdefault(tid, {})[k] = is_s_lock
+
+    # upgrade tid's S-lock on k to an X-lock, which only needs tid to be the one holder left, no queue scan
+    # otherwise tid waits on the upgrade queue of k, ahead of the queued requests, which are blocked by its S-lock
+    # anyway; if another holder already waits there, the two would each wait for the other's S-lock, so tid isn't
+    # parked at all and request() aborts it without waiting for the deadlock detector to find the cycle
+    def _upgrade(self, entry: ItemLock, tid: int, k: int) -> bool:
+        if entry.compatible(tid, False):
+            self._grant(tid, k, False)
+            return True
+        if entry.upgrades:
+            self.waits_for[tid] = set(self.conflicting_holders(k, tid, False))
+            return False
+        entry.upgrades.append(tid)
+        self._park(tid, k)
+        return False
+
+    # park tid on the wait queue of item k
+    def _enqueue(self, entry: ItemLock, tid: int, k: int, is_s_lock: bool) -> None:
+        entry.queue.append((tid, is_s_lock))
+        self._park(tid, k)
+
+    def _park(self, tid: int, k: int) -> None:
+        self.waiting[tid] = k
+        if self.metrics is not None:
+            self.metrics.wait_begin(tid, k)
+        self._update_edges(k)
+
+    # hand the lock on k to the waiting upgrader once it is the only holder left, and after every upgrade is through,
+    # to the waiters at the head of its queue, in order, while they are compatible
+    # a run of S-lock waiters is granted together, an X-lock waiter is granted alone
+    def _grant_waiters(self, k: int) -> None:
+        entry = self.lock_table[k]
+        upgrades = entry.upgrades
+        while upgrades and entry.compatible(upgrades[0], False):
+            self._hand_over(upgrades.popleft(), k, False)
+        queue = entry.queue
+        while queue and not upgrades:
+            tid, is_s_lock = queue[0]
+            if not entry.compatible(tid, is_s_lock):
+                break
+            queue.popleft()
+            self._hand_over(tid, k, is_s_lock)
+        self._update_edges(k)
+
+    # give a waiter the lock it was parked for
+    def _hand_over(self, tid: int, k: int, is_s_lock: bool) -> None:
+        del self.waiting[tid]
+        self.waits_for.pop(tid, None)
+        if self.metrics is not None:
+            self.metrics.wait_end(tid, k, True)
+        self._grant(tid, k, is_s_lock)
+        if self.on_wake is not None:
+            self.on_wake(tid)
+
+    # rebuild the waits-for edges of every waiter of item k
+    # an upgrader waits for the other holders, a queued waiter for the holders it conflicts with, every upgrader and
+    # the conflicting waiters queued ahead of it
+    def _update_edges(self, k: int) -> None:
+        entry = self.lock_table[k]
+        for tid in entry.upgrades:
+            blockers = set(self.conflicting_holders(k, tid, False))
+            if blockers != self.waits_for.get(tid):
+                self.waits_for[tid] = blockers
+                if self.detect_deadlocks:
+                    self._suspects.append(tid)
+        ahead: List[Tuple[int, bool]] = []
+        for tid, is_s_lock in entry.queue:
+            blockers = set(self.conflicting_holders(k, tid, is_s_lock))
+            blockers.update(entry.upgrades)
+            for waiter, waiter_is_s_lock in ahead:
+                if not (is_s_lock and waiter_is_s_lock):
+                    blockers.add(waiter)
+            ahead.append((tid, is_s_lock))
+            if blockers != self.waits_for.get(tid):
+                self.waits_for[tid] = blockers
+                if self.detect_deadlocks:
+                    self._suspects.append(tid)
+
+    # look for cycles through every waiter whose edges changed and abort a victim from each one found
+    def _check_deadlocks(self) -> None:
+        if self._checking:
+            return
+        self._checking = True
+        try:
+            while self._suspects:
+                tid = self._suspects.pop()
+                if tid not in self.waiting:
+                    continue
+                cycle = self.find_cycle(tid)
+                if cycle is not None:
+                    self.abort(self.victim_policy(self, cycle))
+                    # the suspect may still be on another cycle
+                    self._suspects.append(tid)
+        finally:
+            self._checking = False
+
+    # return a cycle of the waits-for graph through start, or None
+    # the search only visits the waiters reachable from start
+    def find_cycle(self, start: int) -> Optional[List[int]]:
+        path = [start]
+        visited = {start}
+        stack = [iter(self.waits_for.get(start, ()))]
+        while stack:
+            for nxt in stack[-1]:
+                if nxt == start:
+                    return list(path)
+                if nxt not in visited and nxt in self.waits_for:
+                    visited.add(nxt)
+                    path.append(nxt)
+                    stack.append(iter(self.waits_for[nxt]))
+                    break
+            else:
+                stack.pop()
+                path.pop()
+        return None
+
+    # abort tid as a deadlock victim: release everything it holds and tell the owner of the transaction
+    def abort(self, tid: int) -> None:
+        tracer.event(SUMMARY, "Deadlock, abort T" + str(tid))
+        if self.metrics is not None:
+            self.metrics.deadlocks += 1
+        if self.on_abort is not None:
+            self.on_abort(tid)
+        self.releaseAll(tid)
+
+    # take tid off the wait queue it is parked on, if any, and drop its waits-for edges
+    def _cancel_wait(self, tid: int) -> None:
+        k = self.waiting.pop(tid, None)
+        self.waits_for.pop(tid, None)
+        if k is None:
+            return
+        if self.metrics is not None:
+            self.metrics.wait_end(tid, k, False)
+        entry = self.lock_table[k]
+        if tid in entry.upgrades:
+            entry.upgrades.remove(tid)
+        else:
+            for i, (waiter, _) in enumerate(entry.queue):
+                if waiter == tid:
+                    del entry.queue[i]
+                    break
+        # whoever was queued behind tid may be grantable now
+        self._grant_waiters(k)
+        self._drop_if_unused(k)
+
+    def _drop_if_unused(self, k: int) -> None:
+        entry = self.lock_table[k]
+        if not entry.holders and not entry.queue and not entry.upgrades:
+            del self.lock_table[k]
+
+    # release all locks held by transaction tid, and withdraw its pending request
     # return the number of locks released
     def releaseAll(self, tid: int) -> int:
-
-        if tid not in self.transaction_locks:
+        self._cancel_wait(tid)
+        locks = self.transaction_locks.pop(tid, None)
+        self.started.pop(tid, None)
+        self.work_done.pop(tid, None)
+        if not locks:
+            self._check_deadlocks()
             return 0
-        locks_released = len(self.transaction_locks[tid])
-        del self.transaction_locks[tid]
-        for item, locks in self.lock_table.items():
-            if tid in locks:
-                locks.remove(tid)
-                self.lock_table[item] = locks
-        return locks_released
+        for item in locks:
+            self.lock_table[item].release(tid)
+            self._grant_waiters(item)
+            self._drop_if_unused(item)
+        self._check_deadlocks()
+        return len(locks)
+
+    # count count executed instructions of tid, for the least_work victim policy
+    def record_work(self, tid: int, count: int = 1) -> None:
+        self.work_done[tid] = self.work_done.get(tid, 0) + count
 
     # return all locks held by tid
     def showLocks(self, tid: int) -> List[Tuple[int, bool]]:
-        locks_held = self.transaction_locks[tid] if tid in self.transaction_locks else []
-        return locks_held
+        return list(self.transaction_locks.get(tid, {}).items())
+
+    # return the tids holding any lock on item
+    def holders(self, item: int) -> Set[int]:
+        entry = self.lock_table.get(item)
+        return entry.holders if entry is not None else set()
+
+    # return the tids other than tid whose locks on item conflict with the lock tid asks for
+    def conflicting_holders(self, item: int, tid: int, is_s_lock: bool) -> List[int]:
+        entry = self.lock_table.get(item)
+        if entry is None:
+            return []
+        if is_s_lock:
+            return [entry.x_owner] if entry.x_owner is not None and entry.x_owner != tid else []
+        return [holder for holder in entry.holders if holder != tid]
+
+    # shows if tid is parked on a wait queue
+    def is_waiting(self, tid: int) -> bool:
+        return tid in self.waiting
 
     # shows if a data item has any lock on it
     def has_lock_on(self, item: int, tid: int) -> bool:
-        for id in self.lock_table[item]:
-            # if there exists any other tids that hold this item and are not the tid, return True
-            if id != tid:
-                return True
-        return False
+        return not self.can_grant_x(item, tid)
 
     # shows if a data item has any x-lock on it
     def has_x_lock_on(self, item: int, tid: int) -> bool:
-        transactions = self.lock_table[item]
-        for id, transaction in enumerate(transactions):
-            # we're only checking other transactions so we need to ignore the current one
-            if tid != id:
-                locks = self.transaction_locks[transaction]
-                for data, is_s_lock in locks:
-                    if not is_s_lock:
-                        return True
-        return False
+        entry = self.lock_table.get(item)
+        # we're only checking other transactions so we need to ignore the current one
+        return entry is not None and entry.x_owner is not None and entry.x_owner != tid
+
+    # an X-lock can be granted if nobody but tid holds a lock on item
+    def can_grant_x(self, item: int, tid: int) -> bool:
+        entry = self.lock_table.get(item)
+        return entry is None or entry.compatible(tid, False)
+
+
+# opcodes of the compiled instruction stream
+OP_READ, OP_WRITE, OP_ADD, OP_SUB, OP_MULT, OP_COPY, OP_COMBINE, OP_PRINT = range(8)
+OPCODES: Dict[str, int] = {'R': OP_READ, 'W': OP_WRITE, 'A': OP_ADD, 'S': OP_SUB, 'M': OP_MULT, 'C': OP_COPY,
+                           'O': OP_COMBINE, 'P': OP_PRINT}
+
+
+# the same table keyed by the raw bytes the file reader sees
+BYTE_OPCODES: Dict[bytes, int] = {operator.encode(): opcode for operator, opcode in OPCODES.items()}
+# a block in which every line has exactly three fields, the last line with or without its newline
+# fields and the whitespace between them are disjoint classes, so the match never backtracks
+_COMMAND_LINE = rb'[^\S\n]*\S+[^\S\n]+\S+[^\S\n]+\S+[^\S\n]*'
+THREE_FIELD_LINES = re.compile(rb'(?:' + _COMMAND_LINE + rb'\n)*(?:' + _COMMAND_LINE + rb')?')
+
+
+class TransactionReader:
+    # reads the commands of a transaction file on demand, about chunk_size bytes at a time
+    # the file is reopened for every chunk so thousands of transactions don't hold thousands of open files
+    def __init__(self, file_name: str, chunk_size: int = 1 << 16):
+        self.file_name = file_name
+        self.chunk_size = chunk_size
+        with open(file_name, 'rb') as file:
+            header = file.readline()
+            self.offset = file.tell()
+        self._parse_header(header)
+        # line number of the last line read so far
+        self.line_number = 1
+        self.exhausted = False
+
+    # the header is "<number of commands> <number of local variables>"
+    def _parse_header(self, header: bytes) -> None:
+        fields = header.split()
+        if len(fields) != 2 or not all(field.lstrip(b'-').isdigit() for field in fields):
+            raise ValueError(self.location(1) + "malformed header " + repr(header.decode(errors='replace')))
+        self.command_count, self.local_count = int(fields[0]), int(fields[1])
+
+    # a fresh reader positioned at the first command
+    def reopen(self) -> "TransactionReader":
+        return TransactionReader(self.file_name, self.chunk_size)
+
+    def location(self, line_number: int) -> str:
+        return self.file_name + ":" + str(line_number) + ": "
+
+    # parse the next chunk of commands into (opcodes, operands1, operands2)
+    def read_chunk(self) -> Tuple[array, array, array]:
+        with open(self.file_name, 'rb') as file:
+            file.seek(self.offset)
+            block = file.read(self.chunk_size)
+            if len(block) < self.chunk_size:
+                self.exhausted = True
+            else:
+                # stop at the last full line, or finish a line longer than the whole chunk
+                end = block.rfind(b'\n')
+                if end == -1:
+                    block += file.readline()
+                else:
+                    block = block[:end + 1]
+        self.offset += len(block)
+        line_count = block.count(b'\n') + (0 if block.endswith(b'\n') or not block else 1)
+        chunk = self._parse_block(block)
+        self.line_number += line_count
+        return chunk
+
+    # fast path: one split over the whole block, once a single regex match has checked that every line has exactly
+    # three fields; the token count alone would let "R 1 1 R" followed by "1 1" through as two commands
+    def _parse_block(self, block: bytes) -> Tuple[array, array, array]:
+        if THREE_FIELD_LINES.fullmatch(block):
+            tokens = block.split()
+            try:
+                return (array('B', map(BYTE_OPCODES.__getitem__, tokens[0::3])),
+                        array('q', map(int, tokens[1::3])),
+                        array('q', map(int, tokens[2::3])))
+            except (KeyError, ValueError, OverflowError):
+                pass
+        return self._parse_lines(block)
+
+    # slow path: parse line by line, skipping blank lines and reporting the first malformed one
+    def _parse_lines(self, block: bytes) -> Tuple[array, array, array]:
+        opcodes, operands1, operands2 = array('B'), array('q'), array('q')
+        for i, line in enumerate(block.splitlines()):
+            fields = line.split()
+            if not fields:
+                continue
+            try:
+                operator, operand1, operand2 = fields
+                opcodes.append(BYTE_OPCODES[operator])
+                operands1.append(int(operand1))
+                operands2.append(int(operand2))
+            except (KeyError, ValueError, OverflowError):
+                raise ValueError(self.location(self.line_number + i + 1) + "malformed command " +
+                                 repr(line.decode(errors='replace'))) from None
+        return opcodes, operands1, operands2
+
+
+# steps of a fused block of local commands, (kind, x, a, b):
+# affine: local[x] = local[x] * a + b, copy: local[x] = local[a], combine: local[x] = local[x] + local[a]
+STEP_AFFINE, STEP_COPY, STEP_COMBINE = range(3)
+
+
+# compile the local commands start..end-1 of a window into steps
+# a run of A, S and M commands on the same local folds into one affine step, "A x 1; M x 2" is local[x] * 2 + 2
+def fold_locals(opcodes: array, operands1: array, operands2: array, start: int,
+                end: int) -> List[Tuple[int, int, int, int]]:
+    steps: List[Tuple[int, int, int, int]] = []
+    for pc in range(start, end):
+        opcode, x, y = opcodes[pc], operands1[pc], operands2[pc]
+        if opcode == OP_COPY:
+            steps.append((STEP_COPY, x, y, 0))
+        elif opcode == OP_COMBINE:
+            steps.append((STEP_COMBINE, x, y, 0))
+        else:
+            a, b = (y, 0) if opcode == OP_MULT else (1, y if opcode == OP_ADD else -y)
+            if steps and steps[-1][0] == STEP_AFFINE and steps[-1][1] == x:
+                _, _, a0, b0 = steps[-1]
+                steps[-1] = (STEP_AFFINE, x, a0 * a, b0 * a + b)
+            else:
+                steps.append((STEP_AFFINE, x, a, b))
+    return steps
+
+
+class TextTransactionReader(TransactionReader):
+    # the same for the text of a transaction file that is already in memory, e.g. one received over a socket
+    # the whole text is parsed as a single chunk
+    def __init__(self, text: bytes, name: str = "<transaction>"):
+        self.file_name = name
+        self.text = text
+        header, _, self.body = text.partition(b'\n')
+        self._parse_header(header)
+        self.line_number = 1
+        self.exhausted = False
+
+    def reopen(self) -> "TextTransactionReader":
+        return TextTransactionReader(self.text, self.file_name)
+
+    def read_chunk(self) -> Tuple[array, array, array]:
+        block, self.body = self.body, b''
+        self.exhausted = True
+        line_count = block.count(b'\n') + (0 if block.endswith(b'\n') or not block else 1)
+        chunk = self._parse_block(block)
+        self.line_number += line_count
+        return chunk
 
 
 class Transaction:
-    def __init__(self, k: int):
+    def __init__(self, k: int, source: Optional[TransactionReader] = None):
         self.local = [i for i in range(k)]
-        self.commands = []
+        # the commands are compiled into an opcode byte and two int operands each,
+        # pc is the index of the next command to run
+        # with a source, these arrays only hold the current window of the file and are refilled on demand
+        self.opcodes = array('B')
+        self.operands1 = array('q')
+        self.operands2 = array('q')
+        self.pc = 0
+        self.source = source
+        # the reader a streamed transaction started with, so it can be read again from the top on restart
+        self.origin = source
+        # number of commands in the windows before the current one
+        self.base = 0
+        # fused runs of local commands in the current window, {first pc: (pc after the run, steps)}
+        # compiled the first time the window reaches a local command, dropped whenever the window changes
+        self.blocks: Optional[Dict[int, Tuple[int, List[Tuple[int, int, int, int]]]]] = None
 
     # read the source-th number from the db and set it local[dest]
     def read(self, db: Database, source: int, dest: int) -> None:
         # read db[x] and store it to local[y]
-        print("read db[", source, "] and store it to local[", dest, "]", sep='')
         self.local[dest] = db.read(source)
 
     # write local[source] to the dest-th number in the db
     def write(self, db: Database, source: int, dest: int) -> None:
         # write local[x] to db[y]
-        print("write local[", source, "] to db[", dest, "]", sep='')
         db.write(dest, self.local[source])
 
     def add(self, source: int, v: int) -> None:
         # local[x] = local[x] + d
-        print("local[", source, "] = local[", source, "] + ", v, sep='')
         self.local[source] += v
 
     def sub(self, source: int, v: int) -> None:
-        print("local[", source, "] = local[", source, "] - ", v, sep='')
         self.local[source] -= v
 
     def mult(self, source: int, v: int) -> None:
-        print("local[", source, "] = local[", source, "] * ", v, sep='')
         self.local[source] *= v
 
     def copy(self, s1: int, s2: int) -> None:
         # local[x] = local[y]
-        print("local[", s1, "] = local[", s2, "] + ", sep='')
         self.local[s1] = self.local[s2]
 
     def combine(self, s1: int, s2: int) -> None:
         # local[x] = local[x] + local[y]
-        print("local[", s1, "] = local[", s1, "] + local[", s2, "]", sep='')
         self.local[s1] += self.local[s2]
 
     def display(self) -> None:
@@ -147,19 +668,141 @@ class Transaction:
             print(num, end=' ')
         print()
 
-    def add_command(self, operator, operand1, operand2):
-        self.commands.append([operator, operand1, operand2])
+    def add_command(self, operator: str, operand1: int, operand2: int) -> None:
+        self.opcodes.append(OPCODES[operator])
+        self.operands1.append(operand1)
+        self.operands2.append(operand2)
+        self.blocks = None
+
+    # find every run of consecutive local commands (A, S, M, C, O) in the window and fold it
+    def _compile_blocks(self) -> Dict[int, Tuple[int, List[Tuple[int, int, int, int]]]]:
+        opcodes = self.opcodes
+        blocks = {}
+        pc, end = 0, len(opcodes)
+        while pc < end:
+            if OP_ADD <= opcodes[pc] <= OP_COMBINE:
+                start = pc
+                while pc < end and OP_ADD <= opcodes[pc] <= OP_COMBINE:
+                    pc += 1
+                blocks[start] = (pc, fold_locals(opcodes, self.operands1, self.operands2, start, pc))
+            else:
+                pc += 1
+        self.blocks = blocks
+        return blocks
 
-    # a transaction is finished if the length of its commands is 0
+    # run the whole run of local commands starting at the pc as one step and move the pc past it
+    # return the pc the run started at
+    def run_local_block(self) -> int:
+        blocks = self.blocks if self.blocks is not None else self._compile_blocks()
+        start = self.pc
+        self.pc, steps = blocks[start]
+        local = self.local
+        for kind, x, a, b in steps:
+            if kind == STEP_AFFINE:
+                local[x] = local[x] * a + b
+            elif kind == STEP_COPY:
+                local[x] = local[a]
+            else:
+                local[x] += local[a]
+        return start
+
+    # the next command as (opcode, operand1, operand2); it stays in place until advance() is called
+    def current(self) -> Tuple[int, int, int]:
+        pc = self.pc
+        return self.opcodes[pc], self.operands1[pc], self.operands2[pc]
+
+    def advance(self) -> None:
+        self.pc += 1
+
+    # number of commands left to run, as announced by the file header for a streamed transaction
+    def remaining(self) -> int:
+        if self.source is not None:
+            return max(self.source.command_count - self.base - self.pc, 0)
+        return len(self.opcodes) - self.pc
+
+    # replace the exhausted window with the next chunk of the source
+    # return False if there is nothing left to read
+    def _refill(self) -> bool:
+        while self.source is not None and not self.source.exhausted:
+            self.base += len(self.opcodes)
+            self.opcodes, self.operands1, self.operands2 = self.source.read_chunk()
+            self.pc = 0
+            self.blocks = None
+            if self.opcodes:
+                return True
+        return False
+
+    # a transaction is finished once the pc has moved past its last command
     def finished(self) -> bool:
-        return len(self.commands) == 0
+        return self.pc >= len(self.opcodes) and not self._refill()
+
+    # skip the remaining commands of an aborted transaction
+    def abort(self) -> None:
+        self.source = None
+        self.pc = len(self.opcodes)
+
+    # start over from the first command with fresh local variables, for executors that retry aborted transactions
+    def restart(self) -> None:
+        self.local = [i for i in range(len(self.local))]
+        self.pc = 0
+        if self.origin is not None:
+            self.source = self.origin.reopen()
+            self.opcodes, self.operands1, self.operands2 = array('B'), array('q'), array('q')
+            self.base = 0
+            self.blocks = None
+            self._refill()
+
+
+# opcode -> handler(transaction, db, operand1, operand2)
+EXECUTE: Tuple[Callable[[Transaction, Database, int, int], None], ...] = (
+    # read
+    lambda transaction, db, x, y: transaction.read(db, x, y),
+    # write
+    lambda transaction, db, x, y: transaction.write(db, x, y),
+    # add
+    lambda transaction, db, x, y: transaction.add(x, y),
+    # subtract
+    lambda transaction, db, x, y: transaction.sub(x, y),
+    # multiply
+    lambda transaction, db, x, y: transaction.mult(x, y),
+    # copy
+    lambda transaction, db, x, y: transaction.copy(x, y),
+    # combine
+    lambda transaction, db, x, y: transaction.combine(x, y),
+    # print the current elements in the database
+    lambda transaction, db, x, y: tracer.event(SUMMARY, db.format()),
+)
+
+# opcode -> what the trace shows for an executed command, formatted with its two operands
+TRACE_FORMATS: Tuple[str, ...] = (
+    "read db[{0}] and store it to local[{1}]",
+    "write local[{0}] to db[{1}]",
+    "local[{0}] = local[{0}] + {1}",
+    "local[{0}] = local[{0}] - {1}",
+    "local[{0}] = local[{0}] * {1}",
+    "local[{0}] = local[{1}]",
+    "local[{0}] = local[{0}] + local[{1}]",
+    "",
+)
+
+
+# run the local commands from the pc on as one fused step, tracing each of them at the full level
+# return the number of commands run
+def execute_local_block(transaction: Transaction, tid: int) -> int:
+    start = transaction.run_local_block()
+    if tracer.level >= FULL:
+        opcodes, operands1, operands2 = transaction.opcodes, transaction.operands1, transaction.operands2
+        for pc in range(start, transaction.pc):
+            tracer.execute(tid, TRACE_FORMATS[opcodes[pc]], operands1[pc], operands2[pc])
+    return transaction.pc - start
 
 
 # set up the program, including creating a database, reading transaction files, and creating transactions
-def setup(item_count: int, transaction_files: List[str]):
-    # create database
-    DB = Database(item_count, True)
-    Manager = LockManager(DB)
+def setup(item_count: int, transaction_files: List[str], victim_policy: str = "youngest",
+          db_file: Optional[str] = None):
+    # create database, or reopen the one stored in db_file
+    DB = Database(item_count, True, db_file)
+    Manager = LockManager(DB, victim_policy)
     transactions = []
     # read transactions and add them to an array of transactions
     for file_name in transaction_files:
@@ -168,16 +811,17 @@ def setup(item_count: int, transaction_files: List[str]):
     return DB, transactions, Manager
 
 
+# only the header is read here, the commands are streamed in as the transaction runs
 def read_transaction_file(file_name: str) -> Transaction:
-    with open(file_name) as file:
-        for i, line in enumerate(file):
-            if i == 0:
-                local_variable_count = line.strip().split(" ")[1]
-                local_variable_count = int(local_variable_count)
-                transaction = Transaction(local_variable_count)
-            else:
-                operator, operand1, operand2 = line.strip().split(" ")
-                transaction.add_command(operator, int(operand1), int(operand2))
+    reader = TransactionReader(file_name)
+    return Transaction(reader.local_count, reader)
+
+
+# a transaction from the text of a transaction file, parsed right away so malformed commands are reported here
+def parse_transaction(text: bytes, name: str = "<transaction>") -> Transaction:
+    reader = TextTransactionReader(text, name)
+    transaction = Transaction(reader.local_count, reader)
+    transaction.finished()
     return transaction
 
 
@@ -194,73 +838,69 @@ def print_transactions(transactions: List[Transaction]) -> None:
         transaction.display()
 
 
-# performs the next command and removes it from the list
-# returns true if this command is allowed to proceed
-def do_next_command(db: Database, manager: LockManager, transaction: Transaction, tid: int):
-    operator, operand1, operand2 = transaction.commands[0]
-    if operator == 'R':
+# performs the next command and moves the transaction's pc past it
+# returns true if this command is allowed to proceed; a denied command stays where it is
+def do_next_command(db: Database, manager: LockManager, transaction: Transaction, tid: int) -> bool:
+    opcode, operand1, operand2 = transaction.current()
+    if opcode == OP_READ:
         granted = manager.request(tid, operand1, True)
-    elif operator == 'W':
+    elif opcode == OP_WRITE:
         granted = manager.request(tid, operand2, False)
     else:
         granted = True
+    if not granted:
+        return False
+    execute_command(db, manager, transaction, tid, opcode, operand1, operand2)
+    return True
 
-    if granted:
-        transaction.commands.pop(0)
 
-    # read
-    if operator == 'R':
-        if granted:
-            print("T" + str(curr_transaction_index) + " execute ", end='')
-            transaction.read(db, operand1, operand2)
-    # write
-    elif operator == 'W':
-        if granted:
-            print("T" + str(curr_transaction_index) + " execute ", end='')
-            transaction.write(db, operand1, operand2)
-    # add
-    elif operator == 'A':
-        print("T" + str(curr_transaction_index) + " execute ", end='')
-        transaction.add(operand1, operand2)
-    # subtract
-    elif operator == 'S':
-        print("T" + str(curr_transaction_index) + " execute ", end='')
-        transaction.sub(operand1, operand2)
-    # multiply
-    elif operator == 'M':
-        print("T" + str(curr_transaction_index) + " execute ", end='')
-        transaction.mult(operand1, operand2)
-    # copy
-    elif operator == 'C':
-        print("T" + str(curr_transaction_index) + " execute ", end='')
-        transaction.copy(operand1, operand2)
-    # combine
-    elif operator == 'O':
-        print("T" + str(curr_transaction_index) + " execute ", end='')
-        transaction.combine(operand1, operand2)
-    # print the current elements in the database
-    elif operator == 'P':
-        db.print()
+# run a command whose lock, if it needs one, is already held, and move the pc past it
+# a write of a value out of int64 range raises ValueOutOfRange before it touches the log or the database
+def execute_command(db: Database, manager: LockManager, transaction: Transaction, tid: int, opcode: int,
+                    operand1: int, operand2: int) -> None:
+    if OP_ADD <= opcode <= OP_COMBINE:
+        # a run of local commands needs no locks and goes back to the scheduler only once
+        manager.record_work(tid, execute_local_block(transaction, tid))
+        return
+    transaction.advance()
+    manager.record_work(tid)
+    if opcode == OP_WRITE:
+        check_value(tid, operand2, transaction.local[operand1])
+        if db.wal is not None:
+            # log the before and after image of db[y] before the write happens
+            db.wal.update(tid, operand2, db.read(operand2), transaction.local[operand1])
+    if opcode != OP_PRINT and tracer.level >= FULL:
+        tracer.execute(tid, TRACE_FORMATS[opcode], operand1, operand2)
+    EXECUTE[opcode](transaction, db, operand1, operand2)
 
-    return granted
 
+# commit tid: the log gets its commit record, then its locks are released
+# returns the LSN of the commit record, or None if there is nothing to wait for; the commit is only durable once the
+# log is flushed past it (db.wal.wait_durable), which executors that report commits to someone wait for
+def commit(db: Database, manager: LockManager, tid: int) -> Optional[int]:
+    lsn = db.wal.commit(tid) if db.wal is not None else None
+    manager.releaseAll(tid)
+    return lsn
 
-# detect deadlock
-def no_deadlock(deadlocks: List[bool], granted: bool, transactions: List[Transaction], tid: int) -> bool:
-    # first, refresh to check if there are any transactions finished; if finished, their deadlock needs to be true
-    for i, transaction in enumerate(transactions):
-        if transaction.finished():
-            deadlocks[i] = True
 
-    # if the current transaction is granted, set all the deadlocks to False
-    if granted:
-        deadlocks = [False] * len(deadlocks)
-    # otherwise, set the deadlocks[tid] to True
-    else:
-        deadlocks[tid] = True
-    # check if everything is true
-    # if there's even one False in the array, there is no deadlock
-    return False in deadlocks
+# undo the writes of an aborted tid; call it while tid still holds its X-locks
+def rollback(db: Database, tid: int) -> None:
+    if db.wal is not None:
+        db.wal.abort(tid, db)
+
+
+# give db a write-ahead log in log_file; if the database lives in a file, first recover it from that log
+def attach_log(db: Database, log_file: str, flush_policy: str, group_size: int, group_interval: float,
+               checkpoint_every: int) -> None:
+    if db.path is not None:
+        losers = recover(log_file, db)
+        if losers:
+            tracer.event(SUMMARY, "Recovery rolled back T" + ", T".join(str(tid) for tid in losers))
+    log = LogManager(log_file, flush_policy, group_size, group_interval, checkpoint_every)
+    log.attach(db)
+    # tids restart at 0 every run, so recovery must never look at records from before this one
+    log.checkpoint()
+    db.wal = log
 
 
 def print_locks(transactions: List[Transaction], manager: LockManager):
@@ -268,23 +908,234 @@ def print_locks(transactions: List[Transaction], manager: LockManager):
         print(manager.showLocks(tid))
 
 
-if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        raise "No command line argument!"
-    DB, transactions, Manager = setup(int(sys.argv[1]), sys.argv[2:])
-    deadlocks = [False] * len(transactions)
-    while processing(transactions):
-        # randomly pick a transaction
-        curr_transaction_index = random.randrange(0, len(transactions))
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run transaction files against a database under strict 2PL.")
+    parser.add_argument("item_count", type=int, help="number of elements in the database")
+    parser.add_argument("files", nargs="+", help="transaction files")
+    parser.add_argument("--mode", choices=["2pl", "mvcc", "occ"], default="2pl",
+                        help="strict two-phase locking, snapshot isolation over multi-version items, "
+                             "or optimistic concurrency control")
+    parser.add_argument("--batch-size", type=int, default=8,
+                        help="finished transactions validated together in occ mode")
+    parser.add_argument("--victim", choices=sorted(VICTIM_POLICIES), default="youngest",
+                        help="which transaction of a deadlock cycle to abort")
+    parser.add_argument("--page-size", type=int, default=0,
+                        help="lock pages of this many items with intention locks in 2pl mode, 0 for item locks only")
+    parser.add_argument("--escalate-after", type=int, default=32,
+                        help="item locks in one page after which a transaction escalates to a page lock, 0 for never")
+    parser.add_argument("--preschedule", action="store_true",
+                        help="in 2pl mode, first run batches of transactions that can't conflict without any locks")
+    parser.add_argument("--min-batch", type=int, default=2,
+                        help="smallest conflict-free batch run without locks, the rest run under the lock manager")
+    parser.add_argument("--vectorize", action="store_true",
+                        help="with --preschedule, run each batch in lockstep on NumPy arrays (needs NumPy)")
+    parser.add_argument("--scheduler", choices=SCHEDULERS, default="random",
+                        help="how the next transaction to run is picked")
+    parser.add_argument("--seed", type=int, default=None, help="seed for the random scheduler")
+    parser.add_argument("--record", default=None,
+                        help="write the executed schedule (every step and its lock outcome) to this file in 2pl mode")
+    parser.add_argument("--replay", default=None,
+                        help="re-execute a schedule written by --record, without the scheduler and lock manager")
+    parser.add_argument("--trace", choices=list(LEVELS), default="full", help="how much of the run to trace")
+    parser.add_argument("--trace-file", default=None, help="write the trace to this file instead of stdout")
+    parser.add_argument("--db-file", default=None,
+                        help="keep the database in this memory-mapped file, reopening it if it already holds "
+                             "item_count items")
+    parser.add_argument("--wal", default=None,
+                        help="write-ahead log file; with --db-file the database is recovered from it on start")
+    parser.add_argument("--flush-policy", choices=FLUSH_POLICIES, default="group",
+                        help="when commits are flushed to the log")
+    parser.add_argument("--group-size", type=int, default=32, help="commits per group flush")
+    parser.add_argument("--group-interval", type=float, default=5.0,
+                        help="longest time in ms a commit waits for its group flush")
+    parser.add_argument("--metrics", default=None,
+                        help="count lock requests, denials, upgrades and waits and dump them to this .json/.csv file")
+    parser.add_argument("--metrics-sample", type=int, default=1,
+                        help="time the waits of every nth transaction only")
+    parser.add_argument("--top", type=int, default=0, help="print the n most requested items at the end")
+    parser.add_argument("--checkpoint-every", type=int, default=1000, help="commits between checkpoints, 0 for none")
+    return parser.parse_args(argv)
+
+
+# run the transactions to completion, one command at a time in the order the scheduler picks
+# only runnable transactions are ever picked: blocked ones are woken by the lock manager, finished ones dropped
+# a recorder (schedule.ScheduleRecorder) gets every step with its outcome and every deadlock abort
+def run(DB: Database, Manager: LockManager, transactions: List[Transaction], scheduler: Scheduler,
+        recorder=None) -> None:
+    def abort(tid: int) -> None:
+        # a deadlock victim gives up its remaining commands and its writes, the other transactions keep running
+        if recorder is not None:
+            recorder.abort(tid)
+        rollback(DB, tid)
+        transactions[tid].abort()
+        scheduler.finish(tid)
+
+    Manager.on_wake = scheduler.wake
+    Manager.on_abort = abort
+    for tid, transaction in enumerate(transactions):
+        if not transaction.finished():
+            scheduler.add(tid)
+    while True:
+        tid = scheduler.next()
+        if tid is None:
+            break
         # process the next instruction
-        curr_transaction = transactions[curr_transaction_index]
-        if not curr_transaction.finished():
-            granted = do_next_command(DB, Manager, curr_transaction, curr_transaction_index)
-            if not no_deadlock(deadlocks, granted, transactions, curr_transaction_index):
-                print("Deadlock")
-                # print_locks(transactions, Manager)
-                break
+        transaction = transactions[tid]
+        try:
+            granted = do_next_command(DB, Manager, transaction, tid)
+        except ValueOutOfRange as error:
+            # the write never happened, the transaction is aborted like a deadlock victim
+            tracer.event(SUMMARY, str(error) + ", abort T" + str(tid))
+            abort(tid)
+            Manager.releaseAll(tid)
+            continue
+        if recorder is not None:
+            recorder.step(tid, granted)
         # if the current transaction is finished, release all locks
-        if curr_transaction.finished():
-            Manager.releaseAll(curr_transaction_index)
+        if transaction.finished():
+            scheduler.finish(tid)
+            commit(DB, Manager, tid)
+        elif Manager.is_waiting(tid):
+            scheduler.block(tid)
+
+
+# start an aborted attempt of tid over from its first command, for executors that retry
+def restart(transaction: Transaction, tid: int, reason: str) -> None:
+    tracer.event(SUMMARY, "Abort T" + str(tid) + " (" + reason + "), restart")
+    transaction.restart()
+
+
+# run transactions that buffer their writes instead of locking (mvcc, occ) in the order the scheduler picks
+# a run of local commands is a single step, a read sees the transaction's own buffered write of the item first and
+# read(tid, item) otherwise, and a write only goes to its buffer; what differs between the modes are the callbacks:
+# begin(tid) starts an attempt, end(tid, writes) takes a finished one with its buffered writes to commit, validate or
+# restart, and idle() is called when nothing can run and returns whether it made something runnable again
+# a write of a value out of int64 range aborts the transaction for good before anything was written, so dropping its
+# buffers through drop(tid) is the whole abort
+def run_buffered(db: Database, transactions: List[Transaction], scheduler: Scheduler, begin: Callable[[int], None],
+                 read: Callable[[int, int], int], end: Callable[[int, Dict[int, int]], None],
+                 drop: Callable[[int], None], idle: Callable[[], bool] = lambda: False) -> None:
+    # per running tid: {item: value to write}
+    writes: Dict[int, Dict[int, int]] = {}
+    for tid, transaction in enumerate(transactions):
+        if not transaction.finished():
+            scheduler.add(tid)
+    while True:
+        tid = scheduler.next()
+        if tid is None:
+            if idle():
+                continue
+            break
+        transaction = transactions[tid]
+        own = writes.get(tid)
+        if own is None:
+            own = writes[tid] = {}
+            begin(tid)
+        opcode, operand1, operand2 = transaction.current()
+        if OP_ADD <= opcode <= OP_COMBINE:
+            execute_local_block(transaction, tid)
+        else:
+            transaction.advance()
+            if opcode != OP_PRINT and tracer.level >= FULL:
+                tracer.execute(tid, TRACE_FORMATS[opcode], operand1, operand2)
+            if opcode == OP_READ:
+                transaction.local[operand2] = own[operand1] if operand1 in own else read(tid, operand1)
+            elif opcode == OP_WRITE:
+                try:
+                    check_value(tid, operand2, transaction.local[operand1])
+                except ValueOutOfRange as error:
+                    tracer.event(SUMMARY, str(error) + ", abort T" + str(tid))
+                    del writes[tid]
+                    drop(tid)
+                    transaction.abort()
+                    scheduler.finish(tid)
+                    continue
+                own[operand2] = transaction.local[operand1]
+            else:
+                EXECUTE[opcode](transaction, db, operand1, operand2)
+        if transaction.finished():
+            end(tid, writes.pop(tid))
+
+
+# re-execute a recorded schedule: the same steps in the same order, with no scheduler and no lock requests
+# Manager only keeps the work counts and is released at every commit
+def replay(DB: Database, Manager: LockManager, transactions: List[Transaction], path: str) -> None:
+    from schedule import ScheduleReader, EVENT_RUN, EVENT_ABORT
+
+    reader = ScheduleReader(path)
+    for kind, tid in reader.events():
+        if tid >= len(transactions):
+            raise ValueError(path + ": schedule has T" + str(tid) + " but only " + str(len(transactions)) +
+                             " transactions were given")
+        transaction = transactions[tid]
+        if kind == EVENT_ABORT:
+            tracer.event(SUMMARY, "Deadlock, abort T" + str(tid))
+            rollback(DB, tid)
+            transaction.abort()
+        elif kind == EVENT_RUN:
+            if transaction.finished():
+                raise ValueError(path + ": schedule runs T" + str(tid) + " past its last command")
+            opcode, operand1, operand2 = transaction.current()
+            execute_command(DB, Manager, transaction, tid, opcode, operand1, operand2)
+            if transaction.finished():
+                commit(DB, Manager, tid)
+
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+    trace_file = open(args.trace_file, "w") if args.trace_file else None
+    tracer.configure(LEVELS[args.trace], trace_file)
+    DB, transactions, Manager = setup(args.item_count, args.files, args.victim, args.db_file)
+    if args.wal:
+        attach_log(DB, args.wal, args.flush_policy, args.group_size, args.group_interval / 1000,
+                   args.checkpoint_every)
+    if args.page_size > 0:
+        from hierarchical import HierarchicalLockManager
+        Manager = HierarchicalLockManager(DB, args.victim, args.page_size, args.escalate_after)
+    if args.metrics or args.top:
+        from metrics import LockMetrics
+        Manager.metrics = LockMetrics(args.item_count, args.metrics_sample)
+    scheduler = make_scheduler(args.scheduler, args.seed, lambda tid: transactions[tid].remaining())
+    if args.mode == "mvcc":
+        from mvcc import run_mvcc
+        commits, aborts = run_mvcc(DB, transactions, scheduler)
+        tracer.flush()
+        print("mvcc: " + str(commits) + " commits, " + str(aborts) + " write-write conflict restarts")
+    elif args.mode == "occ":
+        from occ import run_occ
+        result = run_occ(DB, transactions, scheduler, args.item_count, args.batch_size)
+        tracer.flush()
+        print(result.summary())
+    elif args.replay:
+        replay(DB, Manager, transactions, args.replay)
+    else:
+        recorder = None
+        if args.record:
+            from schedule import ScheduleRecorder
+            recorder = ScheduleRecorder(args.record, args.seed)
+        if args.preschedule:
+            from conflicts import plan, run_batches
+            batches, rest = plan(args.files, args.min_batch)
+            run_batches(DB, Manager, transactions, batches, recorder, args.vectorize)
+            tracer.flush()
+            print("preschedule: " + str(len(transactions) - len(rest)) + " transactions in " + str(len(batches)) +
+                  " conflict-free batches, " + str(len(rest)) + " under the lock manager")
+        run(DB, Manager, transactions, scheduler, recorder)
+        if recorder is not None:
+            recorder.close()
+    tracer.flush()
+    # every transaction left is waiting on another one
+    if processing(transactions):
+        print("Deadlock")
     DB.print()
+    if Manager.metrics is not None:
+        if args.top:
+            print(Manager.metrics.report(args.top))
+        if args.metrics:
+            Manager.metrics.dump(args.metrics, args.top or 10)
+    if args.wal:
+        DB.wal.flush()
+        print(DB.wal.summary())
+    DB.close()
+    if trace_file is not None:
+        trace_file.close()
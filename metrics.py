@@ -0,0 +1,122 @@
+from typing import Dict, List, Tuple
+import csv
+import heapq
+import json
+import time
+from array import array
+
+# wait times are bucketed by powers of two of microseconds: bucket i holds waits shorter than 2**i us
+HISTOGRAM_BUCKETS = 32
+# per-item counters, one preallocated int64 array each
+ITEM_COUNTERS = ("requests", "grants", "denials", "upgrades", "waits", "wait_ns")
+# per-transaction counters, in the order they are kept in the per-tid lists
+TRANSACTION_COUNTERS = ("requests", "grants", "denials", "upgrades", "waits", "wait_ns")
+
+
+class LockMetrics:
+    # Counters and wait-time histograms of a LockManager, cheap enough to leave on.
+    # Every item gets preallocated slots in a few int64 arrays, so counting a request is a handful of array
+    # increments and no allocation. Per-transaction counters and the clock reads that time the waits only cover the
+    # tids that are a multiple of sample_every; with sample_every 1 every transaction is measured.
+    def __init__(self, item_count: int, sample_every: int = 1):
+        self.item_count = item_count
+        self.sample_every = max(sample_every, 1)
+        for name in ITEM_COUNTERS:
+            setattr(self, name, array('q', bytes(8 * item_count)))
+        self.histogram = array('q', bytes(8 * HISTOGRAM_BUCKETS))
+        # {sampled tid: [requests, grants, denials, upgrades, waits, wait_ns]}
+        self.transactions: Dict[int, List[int]] = {}
+        # {sampled tid: perf_counter_ns when it was parked}
+        self.waiting_since: Dict[int, int] = {}
+        self.deadlocks = 0
+
+    def _sampled(self, tid: int) -> bool:
+        return tid % self.sample_every == 0
+
+    def _transaction(self, tid: int) -> List[int]:
+        counters = self.transactions.get(tid)
+        if counters is None:
+            counters = self.transactions[tid] = [0] * len(TRANSACTION_COUNTERS)
+        return counters
+
+    # a call of LockManager.request; a waiter handed the lock later counts as a grant then
+    def request(self, tid: int, k: int, granted: bool, upgrade: bool) -> None:
+        self.requests[k] += 1
+        if granted:
+            self.grants[k] += 1
+        else:
+            self.denials[k] += 1
+        if upgrade:
+            self.upgrades[k] += 1
+        if self._sampled(tid):
+            counters = self._transaction(tid)
+            counters[0] += 1
+            counters[1 if granted else 2] += 1
+            if upgrade:
+                counters[3] += 1
+
+    # tid was parked on the wait queue of k
+    def wait_begin(self, tid: int, k: int) -> None:
+        if k < self.item_count:
+            self.waits[k] += 1
+        if self._sampled(tid):
+            self._transaction(tid)[4] += 1
+            self.waiting_since[tid] = time.perf_counter_ns()
+
+    # tid left the wait queue of k, either with the lock or because it was aborted
+    def wait_end(self, tid: int, k: int, granted: bool) -> None:
+        if granted and k < self.item_count:
+            self.grants[k] += 1
+        since = self.waiting_since.pop(tid, None)
+        if since is None:
+            return
+        waited = time.perf_counter_ns() - since
+        if k < self.item_count:
+            self.wait_ns[k] += waited
+        self._transaction(tid)[5] += waited
+        self.histogram[min((waited // 1000).bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+
+    def totals(self) -> Dict[str, int]:
+        totals = {name: sum(getattr(self, name)) for name in ITEM_COUNTERS}
+        totals["deadlocks"] = self.deadlocks
+        return totals
+
+    # the n items with the most of the given per-item counter, as (item, value) pairs
+    def top_items(self, n: int, by: str = "requests") -> List[Tuple[int, int]]:
+        counter = getattr(self, by)
+        return [(item, counter[item]) for item in heapq.nlargest(n, range(self.item_count), key=counter.__getitem__)
+                if counter[item]]
+
+    def report(self, n: int = 10) -> str:
+        totals = self.totals()
+        lines = ["locks: " + ", ".join(name + " " + str(value) for name, value in totals.items()
+                                       if name != "wait_ns") +
+                 ", waited " + format(totals["wait_ns"] / 1e6, ".3f") + " ms"]
+        for item, requests in self.top_items(n):
+            lines.append("  item %d: %d requests, %d denials, %d upgrades, %d waits, %.3f ms waited" %
+                         (item, requests, self.denials[item], self.upgrades[item], self.waits[item],
+                          self.wait_ns[item] / 1e6))
+        return "\n".join(lines)
+
+    def item_row(self, item: int) -> List[int]:
+        return [item] + [getattr(self, name)[item] for name in ITEM_COUNTERS]
+
+    # write everything to path, as CSV (one row per requested item) if it ends in .csv and as JSON otherwise
+    def dump(self, path: str, n: int = 10) -> None:
+        if path.endswith(".csv"):
+            with open(path, "w", newline="") as file:
+                writer = csv.writer(file)
+                writer.writerow(("item",) + ITEM_COUNTERS)
+                writer.writerows(self.item_row(item) for item in range(self.item_count) if self.requests[item])
+            return
+        document = {
+            "totals": self.totals(),
+            "sample_every": self.sample_every,
+            "wait_histogram_us": {"<" + str(1 << i): count for i, count in enumerate(self.histogram) if count},
+            "top_items": [dict(zip(("item",) + ITEM_COUNTERS, row))
+                          for row in (self.item_row(item) for item, _ in self.top_items(n))],
+            "transactions": {str(tid): dict(zip(TRANSACTION_COUNTERS, counters))
+                             for tid, counters in sorted(self.transactions.items())},
+        }
+        with open(path, "w") as file:
+            json.dump(document, file, indent=2)
@@ -0,0 +1,134 @@
+from typing import Dict, List, Tuple
+import heapq
+from bisect import bisect_right
+
+from main import Database, Transaction, run_buffered, restart
+from scheduler import Scheduler
+
+
+class VersionStore:
+    # Multi-version view of a Database for snapshot isolation.
+    # The Database itself always holds the latest committed value of every item. An item that has been written
+    # while some snapshot might still need an older value also gets a version chain: parallel lists of commit
+    # timestamps and values, oldest first. Items nobody has written keep no chain at all.
+    def __init__(self, db: Database):
+        self.db = db
+        # {item: ([commit timestamps], [values])}
+        self.chains: Dict[int, Tuple[List[int], List[int]]] = {}
+        # {item: timestamp of its latest committed write}
+        self.last_commit: Dict[int, int] = {}
+        self.clock = 0
+        # begin timestamps of the running transactions, as a heap with lazy deletion
+        self.active: Dict[int, int] = {}
+        self.snapshots: List[Tuple[int, int]] = []
+
+    # start a transaction on a snapshot of everything committed so far
+    def begin(self, tid: int) -> int:
+        self.active[tid] = self.clock
+        heapq.heappush(self.snapshots, (self.clock, tid))
+        return self.clock
+
+    def end(self, tid: int) -> None:
+        self.active.pop(tid, None)
+
+    # the oldest snapshot any running transaction reads from
+    def oldest_snapshot(self) -> int:
+        snapshots = self.snapshots
+        while snapshots and self.active.get(snapshots[0][1]) != snapshots[0][0]:
+            heapq.heappop(snapshots)
+        return snapshots[0][0] if snapshots else self.clock
+
+    # value of item as of snapshot ts
+    def read(self, item: int, ts: int) -> int:
+        if self.last_commit.get(item, 0) <= ts:
+            return self.db.read(item)
+        stamps, values = self.chains[item]
+        return values[bisect_right(stamps, ts) - 1]
+
+    # first committer wins: a write-write conflict is an item committed by someone else after the snapshot was taken
+    def conflicts(self, writes: Dict[int, int], ts: int) -> bool:
+        last_commit = self.last_commit
+        return any(last_commit.get(item, 0) > ts for item in writes)
+
+    # install the writes of a committing transaction as new versions, return its commit timestamp
+    # the transaction must already have been end()ed so its own snapshot doesn't hold old versions back
+    def commit(self, tid: int, writes: Dict[int, int]) -> int:
+        self.clock += 1
+        ts = self.clock
+        db = self.db
+        oldest = self.oldest_snapshot()
+        for item, value in writes.items():
+            before = db.read(item)
+            if db.wal is not None:
+                db.wal.update(tid, item, before, value)
+            if oldest < ts:
+                # a running snapshot may still need the value being replaced
+                chain = self.chains.get(item)
+                if chain is None:
+                    chain = self.chains[item] = ([self.last_commit.get(item, 0)], [before])
+                chain[0].append(ts)
+                chain[1].append(value)
+            db.write(item, value)
+            self.last_commit[item] = ts
+        if db.wal is not None:
+            db.wal.commit(tid)
+        self.collect(writes)
+        return ts
+
+    # garbage-collect the chains of items: drop the versions no running snapshot can see any more
+    def collect(self, items) -> None:
+        oldest = self.oldest_snapshot()
+        for item in items:
+            chain = self.chains.get(item)
+            if chain is None:
+                continue
+            stamps, values = chain
+            # the newest version at or before the oldest snapshot is the oldest one still needed
+            keep = bisect_right(stamps, oldest) - 1
+            if keep == len(stamps) - 1:
+                # only the latest version is needed, and the Database holds it
+                del self.chains[item]
+            elif keep > 0:
+                del stamps[:keep]
+                del values[:keep]
+
+    def version_count(self) -> int:
+        return sum(len(stamps) for stamps, _ in self.chains.values())
+
+
+# run the transactions under snapshot isolation: reads come from the snapshot taken when the transaction starts
+# and never block, writes are buffered until commit, and a write-write conflict at commit restarts the transaction
+# return (commits, aborts)
+def run_mvcc(db: Database, transactions: List[Transaction], scheduler: Scheduler) -> Tuple[int, int]:
+    store = VersionStore(db)
+    # per running tid: its snapshot timestamp
+    snapshot: Dict[int, int] = {}
+    commits = aborts = 0
+
+    def begin(tid: int) -> None:
+        snapshot[tid] = store.begin(tid)
+
+    def read(tid: int, item: int) -> int:
+        return store.read(item, snapshot[tid])
+
+    def drop(tid: int) -> None:
+        del snapshot[tid]
+        store.end(tid)
+
+    def end(tid: int, writes: Dict[int, int]) -> None:
+        nonlocal commits, aborts
+        ts = snapshot.pop(tid)
+        store.end(tid)
+        if store.conflicts(writes, ts):
+            aborts += 1
+            restart(transactions[tid], tid, "write-write conflict")
+            return
+        store.commit(tid, writes)
+        commits += 1
+        scheduler.finish(tid)
+        # chains of items nobody writes any more are only collected by an occasional full sweep
+        if commits % 256 == 0:
+            store.collect(list(store.chains))
+
+    run_buffered(db, transactions, scheduler, begin, read, end, drop)
+    return commits, aborts
@@ -0,0 +1,88 @@
+from typing import Dict, List
+from array import array
+
+from main import Database, Transaction, run_buffered, restart
+from scheduler import Scheduler
+
+
+class OCCResult:
+    def __init__(self):
+        self.commits = 0
+        self.aborts = 0
+        # number of validation batches run
+        self.batches = 0
+
+    def abort_rate(self) -> float:
+        attempts = self.commits + self.aborts
+        return self.aborts / attempts if attempts else 0.0
+
+    def summary(self) -> str:
+        return ("occ: " + str(self.commits) + " commits, " + str(self.aborts) + " aborts (" +
+                format(self.abort_rate() * 100, ".1f") + "% abort rate), " + str(self.batches) + " validation batches")
+
+
+# run the transactions optimistically: no locks are taken, every transaction reads the database directly while
+# remembering the version of each item it read, and buffers its writes
+# a finished transaction waits for validation; once batch_size of them are pending (or nothing else can run)
+# they are validated in finishing order against the per-item version counters, so a transaction commits only if
+# none of the items it read has been overwritten since, and the ones that fail restart from their first command
+def run_occ(db: Database, transactions: List[Transaction], scheduler: Scheduler, item_count: int,
+            batch_size: int = 8) -> OCCResult:
+    result = OCCResult()
+    # {item: number of committed writes to it}
+    versions = array('q', bytes(8 * item_count))
+    # per running tid: {item: version it read}; per tid waiting for validation: {item: value to write}
+    read_sets: Dict[int, Dict[int, int]] = {}
+    write_sets: Dict[int, Dict[int, int]] = {}
+    pending: List[int] = []
+
+    def validate() -> None:
+        result.batches += 1
+        for tid in pending:
+            read_set = read_sets.pop(tid)
+            write_set = write_sets.pop(tid)
+            if any(versions[item] != seen for item, seen in read_set.items()):
+                result.aborts += 1
+                restart(transactions[tid], tid, "failed validation")
+                scheduler.add(tid)
+                continue
+            # the writes of a transaction that passed are visible to the next one in the same batch
+            for item, value in write_set.items():
+                if db.wal is not None:
+                    db.wal.update(tid, item, db.read(item), value)
+                db.write(item, value)
+                versions[item] += 1
+            if db.wal is not None:
+                db.wal.commit(tid)
+            result.commits += 1
+        pending.clear()
+
+    def begin(tid: int) -> None:
+        read_sets[tid] = {}
+
+    def read(tid: int, item: int) -> int:
+        read_set = read_sets[tid]
+        # only the first read of an item counts, a later one seeing a newer value fails validation anyway
+        if item not in read_set:
+            read_set[item] = versions[item]
+        return db.read(item)
+
+    def drop(tid: int) -> None:
+        del read_sets[tid]
+        result.aborts += 1
+
+    def end(tid: int, writes: Dict[int, int]) -> None:
+        scheduler.finish(tid)
+        write_sets[tid] = writes
+        pending.append(tid)
+        if len(pending) >= batch_size:
+            validate()
+
+    def idle() -> bool:
+        if not pending:
+            return False
+        validate()
+        return True
+
+    run_buffered(db, transactions, scheduler, begin, read, end, drop, idle)
+    return result
@@ -0,0 +1,85 @@
+from typing import Iterator, Optional, Tuple
+
+# A schedule file is the magic bytes, the seed the run was started with (0 for none, its zigzag encoding << 1 | 1
+# otherwise, so negative seeds fit) and one event per scheduler step, every number as an unsigned LEB128 varint. An event is tid << 2 | kind, so most events
+# of a run with fewer than 32 transactions take one byte.
+MAGIC = b"SCHD\x02"
+# the picked transaction ran its next command (or fused block), its lock request was denied, or it was aborted
+EVENT_RUN, EVENT_DENIED, EVENT_ABORT = range(3)
+
+
+def _varint(value: int, out: bytearray) -> None:
+    while value >= 0x80:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+# the seed header: 0 for no seed, else the seed zigzag encoded (0, -1, 1, -2, ... to 0, 1, 2, 3, ...) with a 1 below
+def _seed_header(seed: Optional[int]) -> int:
+    if seed is None:
+        return 0
+    return (seed << 1 if seed >= 0 else (-seed << 1) - 1) << 1 | 1
+
+
+def _header_seed(header: int) -> Optional[int]:
+    if not header & 1:
+        return None
+    zigzag = header >> 1
+    return -((zigzag + 1) >> 1) if zigzag & 1 else zigzag >> 1
+
+
+class ScheduleRecorder:
+    # buffers the events of a run and writes them to path, buffer_size bytes at a time
+    def __init__(self, path: str, seed: Optional[int] = None, buffer_size: int = 1 << 16):
+        self.file = open(path, "wb")
+        self.buffer_size = buffer_size
+        self.buffer = bytearray(MAGIC)
+        _varint(_seed_header(seed), self.buffer)
+        self.events = 0
+
+    def record(self, kind: int, tid: int) -> None:
+        _varint(tid << 2 | kind, self.buffer)
+        self.events += 1
+        if len(self.buffer) >= self.buffer_size:
+            self.file.write(self.buffer)
+            self.buffer = bytearray()
+
+    def step(self, tid: int, granted: bool) -> None:
+        self.record(EVENT_RUN if granted else EVENT_DENIED, tid)
+
+    def abort(self, tid: int) -> None:
+        self.record(EVENT_ABORT, tid)
+
+    def close(self) -> None:
+        self.file.write(self.buffer)
+        self.buffer = bytearray()
+        self.file.close()
+
+
+class ScheduleReader:
+    def __init__(self, path: str):
+        with open(path, "rb") as file:
+            self.data = file.read()
+        if not self.data.startswith(MAGIC):
+            raise ValueError(path + ": not a schedule file")
+        header, self.offset = self._varint(len(MAGIC))
+        self.seed = _header_seed(header)
+
+    def _varint(self, offset: int) -> Tuple[int, int]:
+        data = self.data
+        value = shift = 0
+        while True:
+            byte = data[offset]
+            offset += 1
+            value |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return value, offset
+            shift += 7
+
+    # (kind, tid) of every recorded event, in order
+    def events(self) -> Iterator[Tuple[int, int]]:
+        offset, end = self.offset, len(self.data)
+        while offset < end:
+            event, offset = self._varint(offset)
+            yield event & 3, event >> 2
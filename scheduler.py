@@ -0,0 +1,132 @@
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
+import abc
+import heapq
+import random
+from collections import deque
+
+
+# A scheduler keeps the set of runnable transactions and picks the next one to run.
+# The executor tells it when a transaction blocks on a lock, is woken up, or finishes,
+# so next() never has to look at finished or blocked transactions.
+class Scheduler(abc.ABC):
+    # add a new runnable transaction
+    @abc.abstractmethod
+    def add(self, tid: int) -> None:
+        pass
+
+    # the transaction is parked on a wait queue, don't pick it until wake()
+    @abc.abstractmethod
+    def block(self, tid: int) -> None:
+        pass
+
+    # the transaction got the lock it was waiting for
+    def wake(self, tid: int) -> None:
+        self.add(tid)
+
+    # the transaction finished or was aborted
+    def finish(self, tid: int) -> None:
+        self.block(tid)
+
+    # return the tid to run next, or None if nothing is runnable
+    @abc.abstractmethod
+    def next(self) -> Optional[int]:
+        pass
+
+
+class RoundRobinScheduler(Scheduler):
+    def __init__(self):
+        self.runnable: Set[int] = set()
+        # runnable tids in turn order; blocked ones are dropped lazily when they reach the front
+        self.queue: Deque[int] = deque()
+        self.queued: Set[int] = set()
+
+    def add(self, tid: int) -> None:
+        self.runnable.add(tid)
+        if tid not in self.queued:
+            self.queued.add(tid)
+            self.queue.append(tid)
+
+    def block(self, tid: int) -> None:
+        self.runnable.discard(tid)
+
+    def next(self) -> Optional[int]:
+        queue = self.queue
+        while queue:
+            tid = queue.popleft()
+            if tid in self.runnable:
+                queue.append(tid)
+                return tid
+            self.queued.discard(tid)
+        return None
+
+
+class RandomScheduler(Scheduler):
+    # picks uniformly among the runnable transactions; a seed makes the picks reproducible
+    def __init__(self, seed: Optional[int] = None):
+        self.random = random.Random(seed)
+        # runnable tids, with {tid: index} so one can be removed by swapping in the last one
+        self.runnable: List[int] = []
+        self.index: Dict[int, int] = {}
+
+    def add(self, tid: int) -> None:
+        if tid not in self.index:
+            self.index[tid] = len(self.runnable)
+            self.runnable.append(tid)
+
+    def block(self, tid: int) -> None:
+        i = self.index.pop(tid, None)
+        if i is None:
+            return
+        last = self.runnable.pop()
+        if last != tid:
+            self.runnable[i] = last
+            self.index[last] = i
+
+    def next(self) -> Optional[int]:
+        if not self.runnable:
+            return None
+        return self.runnable[self.random.randrange(len(self.runnable))]
+
+
+class ShortestRemainingWorkScheduler(Scheduler):
+    # picks the runnable transaction with the fewest commands left, ties go to the lower tid
+    def __init__(self, remaining: Callable[[int], int]):
+        self.remaining = remaining
+        self.runnable: Set[int] = set()
+        # (remaining work, tid) entries; stale ones are fixed up or dropped when they reach the top
+        self.heap: List[Tuple[int, int]] = []
+
+    def add(self, tid: int) -> None:
+        if tid not in self.runnable:
+            self.runnable.add(tid)
+            heapq.heappush(self.heap, (self.remaining(tid), tid))
+
+    def block(self, tid: int) -> None:
+        self.runnable.discard(tid)
+
+    def next(self) -> Optional[int]:
+        heap = self.heap
+        while heap:
+            work, tid = heap[0]
+            if tid not in self.runnable:
+                heapq.heappop(heap)
+                continue
+            current = self.remaining(tid)
+            if current == work:
+                return tid
+            # work only ever goes down, so the entry moves up or stays at the top
+            heapq.heapreplace(heap, (current, tid))
+        return None
+
+
+SCHEDULERS = ["random", "round-robin", "shortest"]
+
+
+def make_scheduler(name: str, seed: Optional[int], remaining: Callable[[int], int]) -> Scheduler:
+    if name == "round-robin":
+        return RoundRobinScheduler()
+    if name == "shortest":
+        return ShortestRemainingWorkScheduler(remaining)
+    if name == "random":
+        return RandomScheduler(seed)
+    raise ValueError("unknown scheduler " + repr(name))
@@ -0,0 +1,226 @@
+from typing import Dict, Optional, Set
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import argparse
+
+from main import (Database, LockManager, Transaction, VICTIM_POLICIES, OP_READ, OP_WRITE, FLUSH_POLICIES,
+                  execute_command, parse_transaction, attach_log, commit, rollback)
+from threaded import TransactionAborted
+from tracing import tracer, LEVELS, SUMMARY
+
+
+# README!!!
+# To keep a database and its lock manager running and take transactions over a socket, do
+# python server.py <number of elements in the database> --socket <path>
+# python server.py <number of elements in the database> --port <n> [--host 127.0.0.1]
+# optional: --victim youngest|fewest_locks|least_work --trace off|summary|locks|full --db-file <path>
+#           --wal <path> --flush-policy always|group|none
+#
+# Protocol: a client sends transactions in the transaction file format, a "<command count> <local count>" header
+# line followed by exactly that many command lines, and may send any number of them before reading a reply.
+# Every transaction runs concurrently with all the others under strict 2PL. Once it commits or is aborted, the
+# server answers with one JSON line: {"id": n, "tid": t, "committed": true, "local": [...], "latency_ms": x},
+# where n counts the transactions of the connection from 0. Replies come in completion order, not request order.
+# A transaction that fails in any way, e.g. can't be parsed, touches an item out of range or writes a value that doesn't
+# fit in an int64, is rolled back and gets {"id": n, "error": "..."}; the other transactions of the connection go on.
+
+
+class AsyncLockManager(LockManager):
+    # A LockManager for transactions running as coroutines on one event loop.
+    # acquire() waits on a future that on_wake resolves once the wait queue hands tid the lock,
+    # or that fails with TransactionAborted when tid is picked as a deadlock victim.
+    def __init__(self, DB: Database, victim_policy: str = "youngest"):
+        super().__init__(DB, victim_policy)
+        self.db = DB
+        self.wakeups: Dict[int, asyncio.Future] = {}
+        self.aborted: Set[int] = set()
+        self.on_wake = self._wake
+        self.on_abort = self._abort_waiter
+
+    def _wake(self, tid: int) -> None:
+        future = self.wakeups.pop(tid, None)
+        if future is not None and not future.done():
+            future.set_result(None)
+
+    # the victim is parked in acquire(), so its writes are undone here while it still holds its locks
+    def _abort_waiter(self, tid: int) -> None:
+        rollback(self.db, tid)
+        self.aborted.add(tid)
+        future = self.wakeups.pop(tid, None)
+        if future is not None and not future.done():
+            future.set_exception(TransactionAborted(tid))
+
+    async def acquire(self, tid: int, k: int, is_s_lock: bool) -> None:
+        if not self.request(tid, k, is_s_lock):
+            # the deadlock check in request() may already have picked tid itself
+            if tid in self.aborted:
+                raise TransactionAborted(tid)
+            # or aborted another victim and handed tid the lock already, before there was a future to wake
+            if tid in self.waiting:
+                future = self.wakeups[tid] = asyncio.get_running_loop().create_future()
+                await future
+
+    def forget(self, tid: int) -> None:
+        self.aborted.discard(tid)
+        self.wakeups.pop(tid, None)
+
+
+# wait until the log of db is flushed past lsn without blocking the loop
+async def wait_durable(db: Database, lsn: Optional[int]) -> None:
+    if lsn is None:
+        return
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    db.wal.when_durable(lsn, lambda: loop.call_soon_threadsafe(future.set_result, None))
+    await future
+
+
+class Server:
+    def __init__(self, db: Database, manager: AsyncLockManager):
+        self.db = db
+        self.manager = manager
+        self.next_tid = 0
+        self.committed = 0
+        self.aborted = 0
+        self.connections = 0
+
+    # run one transaction to the end; it only gives up the loop while it waits for a lock
+    async def run_transaction(self, transaction: Transaction) -> Dict:
+        db, manager = self.db, self.manager
+        tid = self.next_tid
+        self.next_tid += 1
+        start = time.perf_counter()
+        committed = False
+        try:
+            while not transaction.finished():
+                opcode, operand1, operand2 = transaction.current()
+                if opcode == OP_READ:
+                    await manager.acquire(tid, operand1, True)
+                elif opcode == OP_WRITE:
+                    await manager.acquire(tid, operand2, False)
+                execute_command(db, manager, transaction, tid, opcode, operand1, operand2)
+            lsn = commit(db, manager, tid)
+            committed = True
+            # the reply says committed only once the commit record is flushed
+            await wait_durable(db, lsn)
+            self.committed += 1
+        except TransactionAborted:
+            # LockManager.abort has already released everything
+            tracer.event(SUMMARY, "Abort T" + str(tid))
+            transaction.abort()
+            self.aborted += 1
+        except Exception:
+            # a command the database can't run, like one on an item it doesn't have, aborts the transaction
+            rollback(db, tid)
+            self.aborted += 1
+            raise
+        finally:
+            if not committed:
+                manager.releaseAll(tid)
+            manager.forget(tid)
+        return {"tid": tid, "committed": committed, "local": transaction.local,
+                "latency_ms": (time.perf_counter() - start) * 1000}
+
+    async def _answer(self, number: int, text: bytes, writer: asyncio.StreamWriter, name: str) -> None:
+        try:
+            reply = await self.run_transaction(parse_transaction(text, name))
+        except Exception as error:
+            # a transaction that fails for any reason gets an error reply; the other ones on the connection go on
+            reply = {"error": type(error).__name__ + ": " + str(error)}
+        reply["id"] = number
+        writer.write(json.dumps(reply).encode() + b"\n")
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        name = "connection " + str(self.connections)
+        pending: Set[asyncio.Task] = set()
+        number = 0
+        try:
+            while True:
+                header = await reader.readline()
+                if not header:
+                    break
+                if not header.strip():
+                    continue
+                fields = header.split()
+                lines = [header]
+                if len(fields) == 2 and fields[0].isdigit():
+                    for _ in range(int(fields[0])):
+                        line = await reader.readline()
+                        if not line:
+                            break
+                        lines.append(line)
+                # a malformed header is reported by the parser like any other malformed transaction
+                task = asyncio.create_task(self._answer(number, b"".join(lines), writer, name + ", transaction " +
+                                                        str(number)))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+                number += 1
+            if pending:
+                await asyncio.gather(*pending)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def summary(self) -> str:
+        return ("server: " + str(self.connections) + " connections, " + str(self.committed) + " committed, " +
+                str(self.aborted) + " aborted")
+
+
+async def serve(server: Server, socket_path: Optional[str], host: str, port: Optional[int]) -> None:
+    if socket_path is not None:
+        listener = await asyncio.start_unix_server(server.handle, socket_path)
+    else:
+        listener = await asyncio.start_server(server.handle, host, port)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    try:
+        async with listener:
+            tracer.event(SUMMARY, "listening on " + (socket_path or host + ":" + str(port)))
+            tracer.flush()
+            await stop.wait()
+    finally:
+        if socket_path is not None and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+def parse_args(argv) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Keep a database in memory and run transactions sent over a socket.")
+    parser.add_argument("item_count", type=int, help="number of elements in the database")
+    where = parser.add_mutually_exclusive_group(required=True)
+    where.add_argument("--socket", default=None, help="Unix domain socket to listen on")
+    where.add_argument("--port", type=int, default=None, help="TCP port to listen on")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on with --port")
+    parser.add_argument("--victim", choices=sorted(VICTIM_POLICIES), default="youngest",
+                        help="which transaction of a deadlock cycle to abort")
+    parser.add_argument("--trace", choices=list(LEVELS), default="summary", help="how much of the run to trace")
+    parser.add_argument("--db-file", default=None,
+                        help="keep the database in this memory-mapped file, reopening it if it already exists")
+    parser.add_argument("--wal", default=None, help="write-ahead log file")
+    parser.add_argument("--flush-policy", choices=FLUSH_POLICIES, default="group",
+                        help="when commits are flushed to the log")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+    tracer.configure(LEVELS[args.trace])
+    DB = Database(args.item_count, True, args.db_file)
+    if args.wal:
+        attach_log(DB, args.wal, args.flush_policy, 32, 0.005, 1000)
+    Manager = AsyncLockManager(DB, args.victim)
+    daemon = Server(DB, Manager)
+    asyncio.run(serve(daemon, args.socket, args.host, args.port))
+    tracer.flush()
+    print(daemon.summary())
+    if args.wal:
+        DB.wal.flush()
+    DB.close()
@@ -0,0 +1,358 @@
+from typing import Dict, List, Optional, Set, Tuple
+import sys
+import time
+import queue
+import random
+import argparse
+import itertools
+import threading
+import multiprocessing
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
+from concurrent.futures import ThreadPoolExecutor
+
+from main import (Database, LockManager, Transaction, TransactionReader, ValueOutOfRange, OP_READ, OP_WRITE, OP_ADD,
+                  OP_COMBINE, EXECUTE, do_next_command, read_transaction_file, fill, commit, rollback, check_value)
+from wal import LogManager
+from scheduler import RoundRobinScheduler
+from tracing import tracer, LEVELS, SUMMARY
+
+
+# README!!!
+# To split the database across worker processes, do
+# python sharded.py <number of elements in the database> <file 1> <file 2> ... [--shards <n>] [--partition range|hash]
+#
+# Every shard is a process with its own LockManager over its part of the items. The items themselves live in one
+# shared memory block, so any process reads them without copying. A transaction that only touches one shard runs
+# entirely inside that shard's process. A transaction that touches several shards is run by a coordinator thread in
+# the parent: it asks each shard for its locks over the shard's pipe, buffers its writes, and commits with two-phase
+# commit (prepare on every participant, then apply the writes and commit). A lock wait that outlasts --lock-timeout
+# is treated as a possible cross-shard deadlock: the attempt is aborted everywhere and retried after a short backoff.
+
+
+class SharedDatabase(Database):
+    # a Database whose items live in a shared memory block of int64s
+    # the creating process passes no name and owns the block; workers attach to it by name
+    def __init__(self, k: int, nonzero: bool = True, name: Optional[str] = None):
+        self.owner = name is None
+        self.shm = SharedMemory(name=name, create=self.owner, size=max(k, 1) * 8)
+        # the block may be rounded up to a page, so only the first k slots are items
+        self.words = self.shm.buf.cast('q')
+        self.database = self.words[:k]
+        self.path = None
+        self.mapping = None
+        self.wal = None
+        if self.owner:
+            fill(self.database, nonzero)
+
+    def close(self) -> None:
+        self.database.release()
+        self.words.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class Partitioner:
+    # maps an item to the shard that owns it, by contiguous ranges or by item % shards
+    def __init__(self, item_count: int, shards: int, scheme: str = "range"):
+        self.item_count = item_count
+        self.shards = shards
+        self.scheme = scheme
+
+    def shard_of(self, k: int) -> int:
+        if self.scheme == "hash":
+            return k % self.shards
+        return k * self.shards // self.item_count
+
+
+# the items a transaction file reads or writes
+def footprint(file_name: str) -> Set[int]:
+    reader = TransactionReader(file_name)
+    items: Set[int] = set()
+    while not reader.exhausted:
+        opcodes, operands1, operands2 = reader.read_chunk()
+        for opcode, operand1, operand2 in zip(opcodes, operands1, operands2):
+            if opcode == OP_READ:
+                items.add(operand1)
+            elif opcode == OP_WRITE:
+                items.add(operand2)
+    return items
+
+
+# the body of a shard process: run the local transactions round-robin and serve the coordinator in between
+# local transactions use their file index as tid, coordinator attempts use ids above every file index
+def shard_worker(item_count: int, shm_name: str, jobs: List[Tuple[int, str]], conn: Connection,
+                 trace_level: int) -> None:
+    tracer.configure(trace_level)
+    db = SharedDatabase(item_count, name=shm_name)
+    # the local transactions keep their before images so deadlock victims can be undone
+    db.wal = LogManager()
+    manager = LockManager(db)
+    transactions: Dict[int, Transaction] = {tid: read_transaction_file(file_name) for tid, file_name in jobs}
+    scheduler = RoundRobinScheduler()
+    # coordinator attempts that lost their locks here as deadlock victims; they must vote no
+    remote_aborted: Set[int] = set()
+    aborted_local = 0
+
+    def wake(tid: int) -> None:
+        if tid in transactions:
+            scheduler.wake(tid)
+        else:
+            conn.send(("granted", tid, True))
+
+    def abort(tid: int) -> None:
+        nonlocal aborted_local
+        if tid in transactions:
+            tracer.event(SUMMARY, "Abort T" + str(tid))
+            rollback(db, tid)
+            transactions[tid].abort()
+            scheduler.finish(tid)
+            aborted_local += 1
+        else:
+            remote_aborted.add(tid)
+            conn.send(("granted", tid, False))
+
+    manager.on_wake = wake
+    manager.on_abort = abort
+    for tid, transaction in transactions.items():
+        if not transaction.finished():
+            scheduler.add(tid)
+
+    stopping = False
+    while True:
+        while conn.poll():
+            message = conn.recv()
+            kind = message[0]
+            if kind == "lock":
+                _, rid, k, is_s_lock = message
+                if manager.request(rid, k, is_s_lock):
+                    conn.send(("granted", rid, True))
+            elif kind == "prepare":
+                conn.send(("vote", message[1], message[1] not in remote_aborted))
+            elif kind == "commit" or kind == "abort":
+                manager.releaseAll(message[1])
+                remote_aborted.discard(message[1])
+            elif kind == "stop":
+                stopping = True
+        tid = scheduler.next()
+        if tid is None:
+            if stopping:
+                break
+            # nothing runnable here until the coordinator says something
+            conn.poll(None)
+            continue
+        transaction = transactions[tid]
+        try:
+            do_next_command(db, manager, transaction, tid)
+        except ValueOutOfRange as error:
+            tracer.event(SUMMARY, str(error))
+            abort(tid)
+            manager.releaseAll(tid)
+            continue
+        if transaction.finished():
+            scheduler.finish(tid)
+            commit(db, manager, tid)
+        elif manager.is_waiting(tid):
+            scheduler.block(tid)
+
+    tracer.flush()
+    unfinished = sum(1 for transaction in transactions.values() if not transaction.finished())
+    conn.send(("result", len(transactions) - aborted_local - unfinished, aborted_local, unfinished))
+    db.close()
+
+
+class Coordinator:
+    # runs the cross-shard transactions from the parent process, one thread per transaction in flight
+    def __init__(self, db: SharedDatabase, partitioner: Partitioner, conns: List[Connection], first_id: int,
+                 lock_timeout: float):
+        self.db = db
+        self.partitioner = partitioner
+        self.conns = conns
+        self.send_locks = [threading.Lock() for _ in conns]
+        # {attempt id: inbox of the replies meant for it}
+        self.inboxes: Dict[int, "queue.Queue[Tuple]"] = {}
+        self.ids = itertools.count(first_id)
+        self.id_lock = threading.Lock()
+        self.lock_timeout = lock_timeout
+        self.results: List[Optional[Tuple]] = [None] * len(conns)
+        self.receivers = [threading.Thread(target=self._receive, args=(shard,), daemon=True)
+                          for shard in range(len(conns))]
+        for receiver in self.receivers:
+            receiver.start()
+        self.retries = 0
+
+    def _send(self, shard: int, message: Tuple) -> None:
+        with self.send_locks[shard]:
+            self.conns[shard].send(message)
+
+    # hand every reply of a shard to the inbox of the attempt it belongs to; late replies to dead attempts are dropped
+    def _receive(self, shard: int) -> None:
+        conn = self.conns[shard]
+        while True:
+            message = conn.recv()
+            if message[0] == "result":
+                self.results[shard] = message[1:]
+                return
+            inbox = self.inboxes.get(message[1])
+            if inbox is not None:
+                inbox.put(message)
+
+    # run one cross-shard transaction until it commits, return the number of attempts it took
+    # or 0 if it writes a value out of int64 range, which no retry would change
+    def run(self, file_name: str) -> int:
+        for attempt in itertools.count(1):
+            with self.id_lock:
+                rid = next(self.ids)
+            inbox = self.inboxes[rid] = queue.Queue()
+            try:
+                if self._attempt(rid, read_transaction_file(file_name), inbox):
+                    return attempt
+            except ValueOutOfRange as error:
+                tracer.event(SUMMARY, file_name + ": " + str(error) + ", abort")
+                return 0
+            finally:
+                del self.inboxes[rid]
+            with self.id_lock:
+                self.retries += 1
+            time.sleep(random.uniform(0, self.lock_timeout / 10 * min(attempt, 10)))
+        raise AssertionError("unreachable")
+
+    def _lock(self, rid: int, k: int, is_s_lock: bool, inbox: "queue.Queue[Tuple]") -> bool:
+        self._send(self.partitioner.shard_of(k), ("lock", rid, k, is_s_lock))
+        try:
+            return inbox.get(timeout=self.lock_timeout)[2]
+        except queue.Empty:
+            return False
+
+    def _finish(self, rid: int, participants: Set[int], decision: str) -> None:
+        for shard in participants:
+            self._send(shard, (decision, rid))
+
+    def _attempt(self, rid: int, transaction: Transaction, inbox: "queue.Queue[Tuple]") -> bool:
+        db = self.db
+        # {item: is_s_lock} of the locks this attempt holds, and its buffered writes
+        held: Dict[int, bool] = {}
+        writes: Dict[int, int] = {}
+        participants: Set[int] = set()
+        while not transaction.finished():
+            opcode, operand1, operand2 = transaction.current()
+            if opcode == OP_READ or opcode == OP_WRITE:
+                is_s_lock = opcode == OP_READ
+                k = operand1 if is_s_lock else operand2
+                if k not in held or (not is_s_lock and held[k]):
+                    participants.add(self.partitioner.shard_of(k))
+                    if not self._lock(rid, k, is_s_lock, inbox):
+                        self._finish(rid, participants, "abort")
+                        return False
+                    held[k] = is_s_lock and held.get(k, True)
+                if is_s_lock:
+                    # read db[x] into local[y], seeing this attempt's own buffered writes
+                    transaction.local[operand2] = writes[k] if k in writes else db.read(k)
+                else:
+                    try:
+                        check_value(rid, k, transaction.local[operand1])
+                    except ValueOutOfRange:
+                        self._finish(rid, participants, "abort")
+                        raise
+                    writes[k] = transaction.local[operand1]
+                transaction.advance()
+            elif OP_ADD <= opcode <= OP_COMBINE:
+                transaction.run_local_block()
+            else:
+                transaction.advance()
+                EXECUTE[opcode](transaction, db, operand1, operand2)
+
+        # phase one: every participant must still hold this attempt's locks
+        for shard in participants:
+            self._send(shard, ("prepare", rid))
+        votes = 0
+        try:
+            for _ in participants:
+                if inbox.get(timeout=self.lock_timeout)[2]:
+                    votes += 1
+        except queue.Empty:
+            pass
+        if votes < len(participants):
+            self._finish(rid, participants, "abort")
+            return False
+        # phase two: the X-locks are held everywhere, so the writes go straight into shared memory
+        for k, value in writes.items():
+            db.write(k, value)
+        self._finish(rid, participants, "commit")
+        return True
+
+    def stop(self) -> None:
+        for shard in range(len(self.conns)):
+            self._send(shard, ("stop",))
+        for receiver in self.receivers:
+            receiver.join()
+
+
+def run_sharded(item_count: int, files: List[str], shards: int, scheme: str, lock_timeout: float,
+                coordinators: int, trace_level: int) -> Tuple[SharedDatabase, str]:
+    partitioner = Partitioner(item_count, shards, scheme)
+    jobs: List[List[Tuple[int, str]]] = [[] for _ in range(shards)]
+    cross_shard: List[str] = []
+    for tid, file_name in enumerate(files):
+        owners = {partitioner.shard_of(k) for k in footprint(file_name)}
+        if len(owners) > 1:
+            cross_shard.append(file_name)
+        else:
+            jobs[owners.pop() if owners else tid % shards].append((tid, file_name))
+
+    db = SharedDatabase(item_count)
+    start = time.perf_counter()
+    conns, processes = [], []
+    for shard in range(shards):
+        parent_conn, child_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=shard_worker,
+                                          args=(item_count, db.shm.name, jobs[shard], child_conn, trace_level))
+        process.start()
+        conns.append(parent_conn)
+        processes.append(process)
+
+    coordinator = Coordinator(db, partitioner, conns, len(files), lock_timeout)
+    with ThreadPoolExecutor(max_workers=max(coordinators, 1)) as pool:
+        attempts = list(pool.map(coordinator.run, cross_shard))
+    coordinator.stop()
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+
+    committed = sum(result[0] for result in coordinator.results) + sum(1 for count in attempts if count)
+    aborted = sum(result[1] for result in coordinator.results) + attempts.count(0)
+    unfinished = sum(result[2] for result in coordinator.results)
+    summary = ("shards " + str(shards) + ", single-shard " + str(len(files) - len(cross_shard)) +
+               ", cross-shard " + str(len(cross_shard)) + ", committed " + str(committed) + ", aborted " +
+               str(aborted) + ", cross-shard retries " + str(coordinator.retries) + ", " +
+               format(committed / elapsed if elapsed else 0.0, ".1f") + " txn/s")
+    if unfinished:
+        summary += ", deadlocked " + str(unfinished)
+    return db, summary
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run transaction files on a database sharded across processes.")
+    parser.add_argument("item_count", type=int, help="number of elements in the database")
+    parser.add_argument("files", nargs="+", help="transaction files")
+    parser.add_argument("--shards", type=int, default=multiprocessing.cpu_count(), help="number of shard processes")
+    parser.add_argument("--partition", choices=["range", "hash"], default="range",
+                        help="how items are assigned to shards")
+    parser.add_argument("--coordinators", type=int, default=8,
+                        help="number of cross-shard transactions in flight at once")
+    parser.add_argument("--lock-timeout", type=float, default=1.0,
+                        help="seconds a cross-shard lock request may wait before the attempt is retried")
+    parser.add_argument("--trace", choices=list(LEVELS), default="off", help="how much of the run to trace")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+    DB, summary = run_sharded(args.item_count, args.files, max(min(args.shards, args.item_count), 1),
+                              args.partition, args.lock_timeout, args.coordinators, LEVELS[args.trace])
+    try:
+        print(summary)
+        DB.print()
+    finally:
+        DB.close()
@@ -0,0 +1,200 @@
+from typing import Dict, List, Optional, Set, Tuple
+import sys
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from main import (Database, LockManager, Transaction, ValueOutOfRange, VICTIM_POLICIES, OP_READ, OP_WRITE,
+                  execute_command, read_transaction_file, setup, commit, rollback)
+from tracing import tracer, LEVELS, SUMMARY
+
+
+# README!!!
+# To run every transaction on its own worker thread, do
+# python threaded.py <number of elements in the database> <file 1> <file 2> ... [--workers <n>] [--check]
+
+
+class TransactionAborted(Exception):
+    # raised in the worker of a transaction that was picked as a deadlock victim
+    def __init__(self, tid: int):
+        super().__init__("T" + str(tid) + " was aborted")
+        self.tid = tid
+
+
+class ThreadSafeLockManager(LockManager):
+    # A LockManager shared by worker threads. Every public call runs under one re-entrant lock
+    # (deadlock resolution calls releaseAll from inside request), and acquire() blocks the calling
+    # thread on its own condition variable until the wait queue hands it the lock.
+    def __init__(self, DB: Database, victim_policy: str = "youngest"):
+        super().__init__(DB, victim_policy)
+        self.db = DB
+        self.lock = threading.RLock()
+        self.conditions: Dict[int, threading.Condition] = {}
+        self.aborted: Set[int] = set()
+        self.on_wake = self._notify
+        self.on_abort = self._abort_waiter
+
+    def _condition(self, tid: int) -> threading.Condition:
+        condition = self.conditions.get(tid)
+        if condition is None:
+            condition = self.conditions[tid] = threading.Condition(self.lock)
+        return condition
+
+    def _notify(self, tid: int) -> None:
+        self._condition(tid).notify()
+
+    # the victim's thread is parked in acquire(), so its writes are undone here while it still holds its locks
+    def _abort_waiter(self, tid: int) -> None:
+        rollback(self.db, tid)
+        self.aborted.add(tid)
+        self._condition(tid).notify()
+
+    def request(self, tid: int, k: int, is_s_lock: bool) -> int:
+        with self.lock:
+            return super().request(tid, k, is_s_lock)
+
+    def releaseAll(self, tid: int) -> int:
+        with self.lock:
+            return super().releaseAll(tid)
+
+    # drop the per-transaction state once the worker of tid is done with it
+    def forget(self, tid: int) -> None:
+        with self.lock:
+            self.conditions.pop(tid, None)
+            self.aborted.discard(tid)
+
+    def record_work(self, tid: int, count: int = 1) -> None:
+        with self.lock:
+            super().record_work(tid, count)
+
+    # block until tid holds the lock; raise TransactionAborted if tid is picked as a deadlock victim meanwhile
+    def acquire(self, tid: int, k: int, is_s_lock: bool) -> None:
+        with self.lock:
+            if not self.request(tid, k, is_s_lock):
+                condition = self._condition(tid)
+                while tid in self.waiting:
+                    condition.wait()
+            if tid in self.aborted:
+                raise TransactionAborted(tid)
+
+
+# run one transaction to the end on the calling thread
+# a committed tid is appended to commit_order while its locks are still held, so the list is in commit order
+# return (committed, latency in seconds)
+def run_transaction(db: Database, manager: ThreadSafeLockManager, transaction: Transaction, tid: int,
+                    commit_order: Optional[List[int]] = None) -> Tuple[bool, float]:
+    start = time.perf_counter()
+    committed = False
+    lsn = None
+    try:
+        while not transaction.finished():
+            opcode, operand1, operand2 = transaction.current()
+            if opcode == OP_READ:
+                manager.acquire(tid, operand1, True)
+            elif opcode == OP_WRITE:
+                manager.acquire(tid, operand2, False)
+            execute_command(db, manager, transaction, tid, opcode, operand1, operand2)
+        committed = True
+    except TransactionAborted:
+        tracer.event(SUMMARY, "Abort T" + str(tid))
+        transaction.abort()
+    except ValueOutOfRange as error:
+        tracer.event(SUMMARY, str(error) + ", abort T" + str(tid))
+        with manager.lock:
+            rollback(db, tid)
+        transaction.abort()
+    finally:
+        with manager.lock:
+            if committed:
+                if commit_order is not None:
+                    commit_order.append(tid)
+                lsn = commit(db, manager, tid)
+            else:
+                manager.releaseAll(tid)
+            manager.forget(tid)
+    # the locks are already released, so the others go on while this one waits for its group flush
+    if lsn is not None:
+        db.wal.wait_durable(lsn)
+    return committed, time.perf_counter() - start
+
+
+class RunResult:
+    def __init__(self):
+        # tids in the order they committed, which under strict 2PL is an equivalent serial order
+        self.commit_order: List[int] = []
+        self.aborted: List[int] = []
+        self.latencies: List[float] = []
+        self.elapsed = 0.0
+
+    def percentile(self, p: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(int(p * len(ordered)), len(ordered) - 1)]
+
+    def summary(self) -> str:
+        throughput = len(self.commit_order) / self.elapsed if self.elapsed else 0.0
+        return ("committed " + str(len(self.commit_order)) + ", aborted " + str(len(self.aborted)) +
+                ", " + format(throughput, ".1f") + " txn/s, latency p50 " +
+                format(self.percentile(0.5) * 1000, ".3f") + " ms, p99 " +
+                format(self.percentile(0.99) * 1000, ".3f") + " ms")
+
+
+# run every transaction on a pool of worker threads
+def run_threaded(db: Database, manager: ThreadSafeLockManager, transactions: List[Transaction],
+                 workers: int) -> RunResult:
+    result = RunResult()
+    done = threading.Lock()
+
+    def work(tid: int) -> None:
+        committed, latency = run_transaction(db, manager, transactions[tid], tid, result.commit_order)
+        with done:
+            if not committed:
+                result.aborted.append(tid)
+            result.latencies.append(latency)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for future in [pool.submit(work, tid) for tid in range(len(transactions))]:
+            future.result()
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+# replay the committed transactions one after another in commit order and compare the final databases
+# aborted transactions are left out, their writes were undone
+def check_serializable(item_count: int, files: List[str], db: Database, result: RunResult) -> bool:
+    baseline = Database(item_count, True)
+    manager = ThreadSafeLockManager(baseline)
+    for tid in result.commit_order:
+        run_transaction(baseline, manager, read_transaction_file(files[tid]), tid)
+    return baseline.database == db.database
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run transaction files on a pool of worker threads.")
+    parser.add_argument("item_count", type=int, help="number of elements in the database")
+    parser.add_argument("files", nargs="+", help="transaction files")
+    parser.add_argument("--workers", type=int, default=4, help="number of worker threads")
+    parser.add_argument("--victim", choices=sorted(VICTIM_POLICIES), default="youngest",
+                        help="which transaction of a deadlock cycle to abort")
+    parser.add_argument("--trace", choices=list(LEVELS), default="summary", help="how much of the run to trace")
+    parser.add_argument("--check", action="store_true",
+                        help="check the final database against a serial run in commit order")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+    tracer.configure(LEVELS[args.trace])
+    DB, transactions, _ = setup(args.item_count, args.files)
+    Manager = ThreadSafeLockManager(DB, args.victim)
+    result = run_threaded(DB, Manager, transactions, args.workers)
+    tracer.flush()
+    print(result.summary())
+    if args.check:
+        tracer.configure(LEVELS["off"])
+        serializable = check_serializable(args.item_count, args.files, DB, result)
+        print("serializable:", serializable)
+    DB.print()
@@ -0,0 +1,89 @@
+from typing import List, Optional, TextIO, Tuple
+import sys
+import threading
+
+# trace levels, each one includes everything of the levels before it
+# summary: deadlock victims, aborts and P commands
+# locks:   every lock request with its G/D outcome
+# full:    every executed command
+OFF, SUMMARY, LOCKS, FULL = range(4)
+LEVELS = {"off": OFF, "summary": SUMMARY, "locks": LOCKS, "full": FULL}
+
+# record kinds
+REC_TEXT, REC_LOCK, REC_EXEC = range(3)
+
+
+class Tracer:
+    # Collects trace records as plain tuples and only turns them into text when the buffer is flushed,
+    # so a run pays for the formatting and the I/O once per buffer instead of once per operation.
+    # The sink is any text stream: sys.stdout, an open file, or an io.StringIO to keep the trace in memory.
+    def __init__(self, level: int = FULL, sink: Optional[TextIO] = None, buffer_size: int = 4096):
+        self.level = level
+        self.sink = sink
+        self.buffer_size = buffer_size
+        self.records: List[Tuple] = []
+        # appends and flushes can come from several worker threads;
+        # _write_lock keeps concurrent flushes from writing their batches out of order
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def configure(self, level: Optional[int] = None, sink: Optional[TextIO] = None,
+                  buffer_size: Optional[int] = None) -> None:
+        self.flush()
+        if level is not None:
+            self.level = level
+        if sink is not None:
+            self.sink = sink
+        if buffer_size is not None:
+            self.buffer_size = buffer_size
+
+    def _append(self, record: Tuple) -> None:
+        with self._lock:
+            self.records.append(record)
+            full = len(self.records) >= self.buffer_size
+        if full:
+            self.flush()
+
+    # a line that is already text, at the given level
+    def event(self, level: int, text: str) -> None:
+        if self.level >= level:
+            self._append((REC_TEXT, text))
+
+    # "T<tid> request S-lock on item <k>: G"
+    def lock(self, tid: int, k: int, is_s_lock: bool, granted: bool) -> None:
+        if self.level >= LOCKS:
+            self._append((REC_LOCK, tid, k, is_s_lock, granted))
+
+    # "T<tid> execute " followed by template formatted with the two operands
+    def execute(self, tid: int, template: str, operand1: int, operand2: int) -> None:
+        if self.level >= FULL:
+            self._append((REC_EXEC, tid, template, operand1, operand2))
+
+    def flush(self) -> None:
+        with self._write_lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        with self._lock:
+            records, self.records = self.records, []
+        if not records:
+            return
+        lines = []
+        for record in records:
+            kind = record[0]
+            if kind == REC_LOCK:
+                _, tid, k, is_s_lock, granted = record
+                lines.append("T%d request %s-lock on item %d: %s\n" % (tid, "S" if is_s_lock else "X", k,
+                                                                        "G" if granted else "D"))
+            elif kind == REC_EXEC:
+                _, tid, template, operand1, operand2 = record
+                lines.append("T%d execute " % tid + template.format(operand1, operand2) + "\n")
+            else:
+                lines.append(record[1] + "\n")
+        sink = self.sink if self.sink is not None else sys.stdout
+        sink.write("".join(lines))
+        sink.flush()
+
+
+# the tracer shared by the whole program; reconfigure it in place instead of replacing it
+tracer = Tracer()
@@ -0,0 +1,153 @@
+from typing import List, Tuple
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from main import (Database, LockManager, Transaction, OP_READ, OP_WRITE, OP_ADD, OP_SUB, OP_MULT, OP_COPY,
+                  OP_COMBINE, OP_PRINT, INT64_MIN, TRACE_FORMATS, commit, rollback)
+from tracing import tracer, SUMMARY, FULL
+
+# padding after the last command of a shorter transaction
+OP_NONE = 255
+
+
+# Runs a batch of transactions that can't conflict (a batch of conflicts.plan) in lockstep: the locals of the whole
+# batch are one 2-D int64 matrix, a row per transaction, and the n-th commands of all transactions run together as
+# one vectorized operation per opcode. Reads gather db[x] into the matrix and writes scatter it back with fancy
+# indexing; no two transactions of a batch touch the same item with a write, so the order inside a step is free.
+# Locals are int64 like the items they are read from and written to, so the arithmetic wraps where the scalar
+# interpreter's Python ints would leave int64 range: a row whose arithmetic wraps stops writing, and once the batch
+# is done it is rolled back and handed back to run on its own through the scalar interpreter, which aborts it at the
+# write of a value out of range just as it would without lockstep. Needs NumPy; without it batches run one
+# transaction at a time through the scalar interpreter.
+
+
+def available() -> bool:
+    return numpy is not None
+
+
+# every command of a transaction as three arrays, read through to the end of its file
+# the transaction is left finished
+def load_program(transaction: Transaction) -> Tuple[array, array, array]:
+    opcodes, operands1, operands2 = array('B'), array('q'), array('q')
+    while not transaction.finished():
+        pc = transaction.pc
+        opcodes.extend(transaction.opcodes[pc:])
+        operands1.extend(transaction.operands1[pc:])
+        operands2.extend(transaction.operands2[pc:])
+        transaction.pc = len(transaction.opcodes)
+    return opcodes, operands1, operands2
+
+
+# the local variable operands of each command, as (which commands, operand) pairs
+def _local_operands(opcodes, operands1, operands2):
+    yield (opcodes == OP_READ), operands2
+    yield (opcodes == OP_WRITE) | ((opcodes >= OP_ADD) & (opcodes <= OP_COMBINE)), operands1
+    yield (opcodes == OP_COPY) | (opcodes == OP_COMBINE), operands2
+
+
+# which of a + b, a - b or a * b wrapped around int64, elementwise; result is what the wrapped operation gave
+def _overflows(opcode: int, a, b, result):
+    if opcode == OP_SUB:
+        return ((a ^ b) & (a ^ result)) < 0
+    if opcode == OP_MULT:
+        # the wrapped product differs from a * b by a multiple of 2**64, so dividing it back gives a exactly only
+        # when nothing wrapped; MIN * -1 is the one product that wraps onto a value dividing back to a
+        nonzero = b != 0
+        with numpy.errstate(over='ignore'):
+            quotient = result // numpy.where(nonzero, b, 1)
+        return nonzero & ((quotient != a) | ((a == INT64_MIN) & (b == -1)))
+    return ((a ^ result) & (b ^ result)) < 0
+
+
+# run the batch and commit it; return the tids whose arithmetic left int64 range, rolled back and restarted for
+# the caller to run on their own
+def run_batch(DB: Database, Manager: LockManager, transactions: List[Transaction], tids: List[int]) -> List[int]:
+    if not tids:
+        return []
+    programs = [load_program(transactions[tid]) for tid in tids]
+    # longest first, so the transactions still running at step j are always rows 0..active[j]-1
+    order = sorted(range(len(tids)), key=lambda i: -len(programs[i][0]))
+    tids = [tids[i] for i in order]
+    programs = [programs[i] for i in order]
+    rows, length = len(tids), len(programs[0][0])
+    opcodes = numpy.full((rows, length), OP_NONE, dtype=numpy.uint8)
+    operands1 = numpy.zeros((rows, length), dtype=numpy.int64)
+    operands2 = numpy.zeros((rows, length), dtype=numpy.int64)
+    local_counts = numpy.array([len(transactions[tid].local) for tid in tids], dtype=numpy.int64)
+    for row, (row_opcodes, row_operands1, row_operands2) in enumerate(programs):
+        n = len(row_opcodes)
+        opcodes[row, :n] = numpy.frombuffer(row_opcodes, dtype=numpy.uint8)
+        operands1[row, :n] = numpy.frombuffer(row_operands1, dtype=numpy.int64)
+        operands2[row, :n] = numpy.frombuffer(row_operands2, dtype=numpy.int64)
+    for mask, operands in _local_operands(opcodes, operands1, operands2):
+        bad = mask & ((operands < -local_counts[:, None]) | (operands >= local_counts[:, None]))
+        if bad.any():
+            row, pc = map(int, numpy.argwhere(bad)[0])
+            raise IndexError("T" + str(tids[row]) + " command " + str(pc + 1) + ": local[" +
+                             str(operands[row, pc]) + "] out of range")
+    # a negative local index counts from the end of the transaction's own locals, as it does for a list
+    for mask, operands in _local_operands(opcodes, operands1, operands2):
+        numpy.add(operands, local_counts[:, None], out=operands, where=mask & (operands < 0))
+    width = int(local_counts.max())
+    local = numpy.tile(numpy.arange(width, dtype=numpy.int64), (rows, 1))
+    lengths = numpy.array([len(program[0]) for program in programs], dtype=numpy.int64)
+    active = numpy.searchsorted(-lengths, -numpy.arange(length), side='left')
+    items = numpy.frombuffer(DB.database, dtype=numpy.int64)
+    wrapped = numpy.zeros(rows, dtype=bool)
+    trace = tracer.level >= FULL
+    for step in range(length):
+        n = int(active[step])
+        step_opcodes = opcodes[:n, step]
+        x = operands1[:n, step]
+        y = operands2[:n, step]
+        for opcode in numpy.unique(step_opcodes).tolist():
+            at = numpy.flatnonzero(step_opcodes == opcode)
+            xs, ys = x[at], y[at]
+            if opcode == OP_READ:
+                local[at, ys] = items[xs]
+            elif opcode == OP_WRITE:
+                keep = ~wrapped[at]
+                at, xs, ys = at[keep], xs[keep], ys[keep]
+                values = local[at, xs]
+                if DB.wal is not None:
+                    for tid, item, before, after in zip((tids[i] for i in at.tolist()), ys.tolist(),
+                                                        items[ys].tolist(), values.tolist()):
+                        DB.wal.update(tid, item, before, after)
+                items[ys] = values
+            elif opcode == OP_ADD or opcode == OP_SUB or opcode == OP_MULT or opcode == OP_COMBINE:
+                a = local[at, xs]
+                b = local[at, ys] if opcode == OP_COMBINE else ys
+                if opcode == OP_SUB:
+                    result = a - b
+                elif opcode == OP_MULT:
+                    result = a * b
+                else:
+                    result = a + b
+                wrapped[at] |= _overflows(opcode, a, b, result)
+                local[at, xs] = result
+            elif opcode == OP_COPY:
+                local[at, xs] = local[at, ys]
+            elif opcode == OP_PRINT:
+                for _ in range(len(at)):
+                    tracer.event(SUMMARY, DB.format())
+        if trace:
+            for row in range(n):
+                opcode = int(step_opcodes[row])
+                if opcode != OP_PRINT:
+                    tracer.execute(tids[row], TRACE_FORMATS[opcode], int(x[row]), int(y[row]))
+    del items
+    again: List[int] = []
+    for row, tid in enumerate(tids):
+        if wrapped[row]:
+            tracer.event(SUMMARY, "T" + str(tid) + " leaves int64 range in lockstep, roll it back and run it alone")
+            rollback(DB, tid)
+            transactions[tid].restart()
+            again.append(tid)
+            continue
+        transactions[tid].local = local[row, :int(local_counts[row])].tolist()
+        commit(DB, Manager, tid)
+    return again
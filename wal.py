@@ -0,0 +1,269 @@
+from typing import Callable, Dict, List, Optional, Set, Tuple
+import os
+import time
+import struct
+import threading
+
+# log record types
+REC_BEGIN, REC_UPDATE, REC_COMMIT, REC_ABORT, REC_CLR, REC_CHECKPOINT = range(6)
+# every record is (type, tid, item, before, after) packed into 33 bytes; a record's LSN is its offset in the log
+# BEGIN/COMMIT/ABORT leave item, before and after at 0, a CLR is the write undoing an UPDATE,
+# a CHECKPOINT stores the LSN where the oldest transaction active at that point began in its item field
+RECORD = struct.Struct('<Bqqqq')
+
+FLUSH_POLICIES = ["always", "group", "none"]
+
+
+class LogManager:
+    # Write-ahead log of the writes made to a Database.
+    # Every transaction keeps its before images in memory so an abort can undo its writes. With a path, the
+    # records also go to a log file: they are buffered and written out when commits are flushed, which depends on
+    # flush_policy:
+    #   always: every commit writes and fsyncs the log before it returns
+    #   group:  commits wait until group_size of them are pending, or the oldest has waited group_interval seconds,
+    #           and all of them share one write and one fsync; a timer thread flushes the group that never fills
+    #   none:   commits write the log to the OS but never fsync it
+    # commit() only appends the commit record and returns its LSN; a commit is done once wait_durable() (threads)
+    # or when_durable() (event loops) says the log is flushed past it.
+    # Once attached to a file-backed database, every record is flushed before update() or abort() returns, so no
+    # write can reach the database file ahead of the log record that undoes it.
+    # Every checkpoint_every commits the database file and the log are flushed and a checkpoint is recorded, so
+    # recovery only has to redo the records after the last checkpoint.
+    def __init__(self, path: Optional[str] = None, flush_policy: str = "group", group_size: int = 32,
+                 group_interval: float = 0.005, checkpoint_every: int = 0):
+        self.path = path
+        self.flush_policy = flush_policy
+        self.group_size = group_size
+        self.group_interval = group_interval
+        self.checkpoint_every = checkpoint_every
+        self.db = None
+        # {tid: [(item, before image)]} of every transaction still running
+        self.undo: Dict[int, List[Tuple[int, int]]] = {}
+        # {tid: LSN of its BEGIN record}
+        self.begin_lsn: Dict[int, int] = {}
+        self.buffer = bytearray()
+        self.file = open(path, "ab") if path is not None else None
+        self.flushed_lsn = self.file.tell() if self.file is not None else 0
+        # commit times of the commits waiting for the next flush
+        self.pending_commits: List[float] = []
+        self.commits_since_checkpoint = 0
+        self.lock = threading.RLock()
+        # notified after every flush, and when a group gets its first commit
+        self.flushed = threading.Condition(self.lock)
+        # callbacks of when_durable() waiting for the next flush
+        self.on_flush: List[Callable[[], None]] = []
+        # set by attach() for a database that lives in a file
+        self.write_through = False
+        # measurements
+        self.commit_latencies: List[float] = []
+        self.flushes = 0
+        self.bytes_written = 0
+        self.started = time.perf_counter()
+        self.timer: Optional[threading.Thread] = None
+        if self.file is not None and flush_policy == "group":
+            self.timer = threading.Thread(target=self._flush_groups, daemon=True)
+            self.timer.start()
+
+    # the database whose file is flushed at checkpoints
+    def attach(self, db) -> None:
+        self.db = db
+        self.write_through = self.file is not None and db.path is not None
+
+    # the timer thread: flush the pending group once its oldest commit has waited group_interval
+    def _flush_groups(self) -> None:
+        with self.flushed:
+            while self.file is not None:
+                if not self.pending_commits:
+                    self.flushed.wait()
+                    continue
+                left = self.pending_commits[0] + self.group_interval - time.perf_counter()
+                if left > 0:
+                    self.flushed.wait(left)
+                else:
+                    self.flush()
+
+    def _append(self, kind: int, tid: int, item: int = 0, before: int = 0, after: int = 0) -> int:
+        lsn = self.flushed_lsn + len(self.buffer)
+        self.buffer += RECORD.pack(kind, tid, item, before, after)
+        return lsn
+
+    # log that tid is about to change item from before to after; called before the write reaches the database
+    def update(self, tid: int, item: int, before: int, after: int) -> None:
+        with self.lock:
+            undo = self.undo.get(tid)
+            if undo is None:
+                undo = self.undo[tid] = []
+                if self.file is not None:
+                    self.begin_lsn[tid] = self._append(REC_BEGIN, tid)
+            undo.append((item, before))
+            if self.file is not None:
+                self._append(REC_UPDATE, tid, item, before, after)
+                if self.write_through:
+                    self.flush()
+
+    # append the commit record of tid and return its LSN, or None if tid logged nothing
+    # the commit is not durable yet unless the policy flushed it here; see wait_durable() and when_durable()
+    def commit(self, tid: int) -> Optional[int]:
+        with self.lock:
+            self.undo.pop(tid, None)
+            # read-only transactions leave nothing in the log
+            if self.begin_lsn.pop(tid, None) is None:
+                return None
+            lsn = self._append(REC_COMMIT, tid)
+            now = time.perf_counter()
+            self.pending_commits.append(now)
+            if (self.flush_policy != "group" or len(self.pending_commits) >= self.group_size or
+                    now - self.pending_commits[0] >= self.group_interval):
+                self.flush()
+            elif len(self.pending_commits) == 1:
+                # start the timer of the new group
+                self.flushed.notify_all()
+            self.commits_since_checkpoint += 1
+            if self.checkpoint_every and self.commits_since_checkpoint >= self.checkpoint_every:
+                self.checkpoint()
+            return lsn
+
+    # block until the log is flushed past lsn, or closed
+    def wait_durable(self, lsn: int) -> None:
+        with self.flushed:
+            while self.flushed_lsn <= lsn and self.file is not None:
+                self.flushed.wait()
+
+    # call callback once the log is flushed past lsn: right away if it already is, else from the flushing thread
+    def when_durable(self, lsn: int, callback: Callable[[], None]) -> None:
+        with self.lock:
+            if self.flushed_lsn <= lsn and self.file is not None:
+                self.on_flush.append(callback)
+                return
+        callback()
+
+    # undo every write of tid, newest first, while tid still holds its X-locks
+    def abort(self, tid: int, db) -> None:
+        with self.lock:
+            undo = self.undo.pop(tid, [])
+            if self.file is not None:
+                # {item: its value as the undo goes along}, for the CLRs of an item written more than once
+                current: Dict[int, int] = {}
+                for item, before in reversed(undo):
+                    self._append(REC_CLR, tid, item, current.get(item, db.read(item)), before)
+                    current[item] = before
+                if self.write_through:
+                    self.flush()
+            for item, before in reversed(undo):
+                db.write(item, before)
+            if self.begin_lsn.pop(tid, None) is not None:
+                self._append(REC_ABORT, tid)
+
+    # write the buffered records out, fsync them unless the policy is none, and complete the pending commits
+    def flush(self) -> None:
+        with self.lock:
+            if self.file is None:
+                return
+            if self.buffer:
+                self.file.write(self.buffer)
+                self.file.flush()
+                self.bytes_written += len(self.buffer)
+                self.flushed_lsn += len(self.buffer)
+                self.buffer = bytearray()
+            if self.flush_policy != "none":
+                os.fsync(self.file.fileno())
+            self.flushes += 1
+            now = time.perf_counter()
+            self.commit_latencies.extend(now - committed for committed in self.pending_commits)
+            self.pending_commits = []
+            self.flushed.notify_all()
+            callbacks, self.on_flush = self.on_flush, []
+            for callback in callbacks:
+                callback()
+
+    # make everything up to here durable and remember where recovery can start
+    def checkpoint(self) -> None:
+        with self.lock:
+            if self.file is None:
+                return
+            self.flush()
+            if self.db is not None:
+                self.db.flush()
+            oldest = min(self.begin_lsn.values(), default=self.flushed_lsn)
+            lsn = self._append(REC_CHECKPOINT, 0, oldest)
+            self.flush()
+            with open(self.path + ".master", "w") as master:
+                master.write(str(lsn))
+                master.flush()
+                os.fsync(master.fileno())
+            self.commits_since_checkpoint = 0
+
+    # flush and close the log file; commits still waiting for a flush are let go
+    def close(self) -> None:
+        with self.lock:
+            if self.file is not None:
+                self.flush()
+                self.file.close()
+                self.file = None
+                self.flushed.notify_all()
+        if self.timer is not None and self.timer is not threading.current_thread():
+            self.timer.join()
+            self.timer = None
+
+    def summary(self) -> str:
+        elapsed = time.perf_counter() - self.started
+        latencies = sorted(self.commit_latencies)
+        p50 = latencies[len(latencies) // 2] if latencies else 0.0
+        p99 = latencies[min(int(0.99 * len(latencies)), len(latencies) - 1)] if latencies else 0.0
+        return ("log: " + str(len(latencies)) + " commits, " + str(self.flushes) + " flushes, " +
+                str(self.bytes_written) + " bytes, " + format(self.bytes_written / elapsed / 1024, ".1f") +
+                " KiB/s, commit latency p50 " + format(p50 * 1000, ".3f") + " ms, p99 " +
+                format(p99 * 1000, ".3f") + " ms")
+
+
+def read_records(path: str, start: int) -> List[Tuple[int, Tuple[int, int, int, int, int]]]:
+    # (LSN, record) of every complete record from start on; a torn record at the end is ignored
+    with open(path, "rb") as file:
+        file.seek(start)
+        data = file.read()
+    usable = len(data) - len(data) % RECORD.size
+    return [(start + offset, RECORD.unpack_from(data, offset)) for offset in range(0, usable, RECORD.size)]
+
+
+# bring db back to a consistent state after a crash: redo the history after the last checkpoint,
+# then undo the writes of every transaction that neither committed nor aborted
+# return the tids that were rolled back
+def recover(path: str, db) -> List[int]:
+    if not os.path.exists(path):
+        return []
+    checkpoint_lsn = 0
+    if os.path.exists(path + ".master"):
+        with open(path + ".master") as master:
+            checkpoint_lsn = int(master.read() or 0)
+    start = checkpoint_lsn
+    if checkpoint_lsn:
+        checkpoint = read_records(path, checkpoint_lsn)
+        if checkpoint and checkpoint[0][1][0] == REC_CHECKPOINT:
+            start = min(checkpoint_lsn, checkpoint[0][1][2])
+        else:
+            start = checkpoint_lsn = 0
+    records = read_records(path, start)
+
+    finished: Set[int] = set()
+    for lsn, (kind, tid, item, before, after) in records:
+        if kind == REC_COMMIT or kind == REC_ABORT:
+            finished.add(tid)
+        # redo: the database file holds every write up to the checkpoint
+        elif (kind == REC_UPDATE or kind == REC_CLR) and lsn >= checkpoint_lsn:
+            db.write(item, after)
+
+    # undo: before images are absolute values, so the losers' updates are reverted newest first
+    # (a write already undone by a CLR just gets its before image again)
+    losers: List[int] = []
+    for lsn, (kind, tid, item, before, after) in reversed(records):
+        if kind == REC_UPDATE and tid not in finished:
+            db.write(item, before)
+            if tid not in losers:
+                losers.append(tid)
+    if losers:
+        with open(path, "ab") as file:
+            for tid in losers:
+                file.write(RECORD.pack(REC_ABORT, tid, 0, 0, 0))
+            file.flush()
+            os.fsync(file.fileno())
+    return sorted(losers)
@@ -0,0 +1,122 @@
+from typing import Dict, List, Optional
+import os
+import sys
+import random
+import argparse
+from bisect import bisect_left
+from itertools import accumulate
+
+
+# README!!!
+# To write synthetic transaction files, do
+# python workload.py <directory> --items <n> --transactions <n> --length <n> [--read-ratio <r>] [--skew <s>]
+#                    [--mix R=4,W=2,A=1,S=1,M=1,C=1,O=1] [--locals <n>] [--seed <n>]
+
+OPERATORS = "RWASMCO"
+DEFAULT_MIX = "R=4,W=2,A=1,S=1,M=1,C=1,O=1"
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    # "R=4,W=2,A=1" -> {'R': 4.0, 'W': 2.0, 'A': 1.0}, operators left out get weight 0
+    mix = {operator: 0.0 for operator in OPERATORS}
+    for field in text.split(","):
+        operator, _, weight = field.partition("=")
+        operator = operator.strip().upper()
+        if operator not in mix or not weight:
+            raise ValueError("malformed instruction mix entry " + repr(field))
+        mix[operator] = float(weight)
+    if sum(mix.values()) <= 0:
+        raise ValueError("instruction mix " + repr(text) + " has no positive weight")
+    return mix
+
+
+class ItemPicker:
+    # picks items 0..items-1, uniformly for skew 0 and following a Zipf distribution with exponent skew otherwise
+    # the hot items are scattered over the database instead of all sitting at its start
+    def __init__(self, items: int, skew: float, rng: random.Random):
+        self.rng = rng
+        self.items = items
+        self.cumulative: Optional[List[float]] = None
+        if skew > 0:
+            self.cumulative = list(accumulate(1.0 / rank ** skew for rank in range(1, items + 1)))
+            self.order = list(range(items))
+            rng.shuffle(self.order)
+
+    def pick(self) -> int:
+        if self.cumulative is None:
+            return self.rng.randrange(self.items)
+        rank = bisect_left(self.cumulative, self.rng.random() * self.cumulative[-1])
+        return self.order[min(rank, self.items - 1)]
+
+
+# write transaction_count transaction files of length commands each to directory
+# read_ratio, if given, splits the combined R and W weight of the mix between reads and writes
+# the first half of the locals carry data, the second half keep their initial value and only ever feed C and O,
+# so values grow at most linearly with the number of transactions and never leave the int64 range of the database
+# return the file names
+def generate(directory: str, item_count: int, transaction_count: int, length: int, read_ratio: Optional[float] = None,
+             skew: float = 0.0, mix: str = DEFAULT_MIX, local_count: int = 4, seed: Optional[int] = None) -> List[str]:
+    if local_count < 2:
+        raise ValueError("a transaction needs at least 2 local variables, got " + str(local_count))
+    rng = random.Random(seed)
+    weights = parse_mix(mix)
+    if read_ratio is not None:
+        access = weights['R'] + weights['W']
+        weights['R'], weights['W'] = access * read_ratio, access * (1 - read_ratio)
+    operators = [operator for operator in OPERATORS if weights[operator] > 0]
+    cumulative = list(accumulate(weights[operator] for operator in operators))
+    picker = ItemPicker(item_count, skew, rng)
+    data = local_count // 2
+    constants = range(data, local_count)
+
+    os.makedirs(directory, exist_ok=True)
+    file_names = []
+    width = len(str(transaction_count - 1))
+    for i in range(transaction_count):
+        lines = [str(length) + " " + str(local_count)]
+        for _ in range(length):
+            operator = operators[bisect_left(cumulative, rng.random() * cumulative[-1])]
+            x = rng.randrange(data)
+            if operator == 'R':
+                lines.append("R " + str(picker.pick()) + " " + str(x))
+            elif operator == 'W':
+                lines.append("W " + str(x) + " " + str(picker.pick()))
+            elif operator == 'A' or operator == 'S':
+                lines.append(operator + " " + str(x) + " " + str(rng.randint(1, 9)))
+            elif operator == 'M':
+                lines.append("M " + str(x) + " " + str(rng.choice((-1, 1))))
+            elif operator == 'C':
+                lines.append("C " + str(x) + " " + str(rng.randrange(local_count)))
+            else:
+                lines.append("O " + str(x) + " " + str(rng.choice(constants)))
+        file_name = os.path.join(directory, "t" + str(i).zfill(width) + ".txt")
+        with open(file_name, "w") as file:
+            file.write("\n".join(lines) + "\n")
+        file_names.append(file_name)
+    return file_names
+
+
+def add_workload_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--items", type=int, default=1000, help="number of elements in the database")
+    parser.add_argument("--transactions", type=int, default=1000, help="number of transaction files")
+    parser.add_argument("--length", type=int, default=20, help="commands per transaction")
+    parser.add_argument("--read-ratio", type=float, default=None,
+                        help="share of reads among the R and W commands, overriding the mix")
+    parser.add_argument("--skew", type=float, default=0.0, help="Zipf exponent of the item accesses, 0 for uniform")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="relative weights of the R/W/A/S/M/C/O commands")
+    parser.add_argument("--locals", type=int, default=4, help="local variables per transaction")
+    parser.add_argument("--seed", type=int, default=None, help="seed for the generator")
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Write synthetic transaction files.")
+    parser.add_argument("directory", help="where to write the files")
+    add_workload_arguments(parser)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+    names = generate(args.directory, args.items, args.transactions, args.length, args.read_ratio, args.skew,
+                     args.mix, args.locals, args.seed)
+    print("wrote " + str(len(names)) + " transactions to " + args.directory)